@@ -14,6 +14,7 @@ image = (
         "torch",
         "torchaudio",
         "ffmpeg-python",
+        "requests",
         "fastapi",
         "uvicorn",
         "python-multipart"
@@ -34,17 +35,17 @@ app = modal.App("vocalize-cloud", image=image)
 )
 def process_audio_cloud(youtube_url: str = None, audio_url: str = None):
     import subprocess
-    import shutil
-    import requests
+    import tempfile
     from pathlib import Path
     # Import from the mounted backend package
     from backend.cloud.supabase_client import SupabaseManager
+    from backend.services.media_io import download_to_file
 
     print(f"Processing on Cloud GPU...")
     
     # Setup paths
-    output_dir = Path("/tmp/audio")
-    output_dir.mkdir(parents=True, exist_ok=True)
+    # One directory per call, so concurrent inputs don't pick up each other's files
+    output_dir = Path(tempfile.mkdtemp(prefix="audio_", dir="/tmp"))
     
     # 1. Download
     if youtube_url:
@@ -57,18 +58,14 @@ def process_audio_cloud(youtube_url: str = None, audio_url: str = None):
             youtube_url
         ]
         subprocess.run(cmd, check=True)
+        downloaded_file = next(output_dir.glob("*.wav"))
     elif audio_url:
         print(f"Downloading File: {audio_url}")
-        response = requests.get(audio_url)
-        # Try to get filename from header or use default
-        filename = "uploaded_song.wav"
-        with open(output_dir / filename, "wb") as f:
-            f.write(response.content)
+        # Streamed to disk in chunks, capped at MAX_MEDIA_MB
+        downloaded_file = Path(download_to_file(audio_url, str(output_dir), prefix="uploaded_song"))
     else:
         return {"status": "error", "message": "No input provided"}
     
-    # Find downloaded file
-    downloaded_file = next(output_dir.glob("*.wav"))
     print(f"Downloaded: {downloaded_file}")
     
     # 2. Run Demucs
@@ -98,7 +95,7 @@ def process_audio_cloud(youtube_url: str = None, audio_url: str = None):
     timestamp = int(time.time())
     
     # Upload original
-    orig_path = f"uploads/{timestamp}_{song_name}.wav"
+    orig_path = f"uploads/{timestamp}_{song_name}{downloaded_file.suffix}"
     orig_url = sb.upload_file(str(downloaded_file), "audio", orig_path)
     
     # Upload stems
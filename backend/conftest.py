@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+SAMPLE_RATE = 44100
+
+
+def _sustained_tone(seconds, freq=440.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    tone = (0.5 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return np.stack([tone, tone])
+
+
+def _level_dip(audio, window=512):
+    """Lowest short-term RMS relative to the median, ignoring the first and last second."""
+    rms = np.sqrt(np.convolve(audio.mean(axis=0) ** 2, np.ones(window) / window, mode="valid"))
+    rms = rms[SAMPLE_RATE:-SAMPLE_RATE]
+    return rms.min() / np.median(rms)
+
+
+@pytest.fixture
+def samplerate():
+    return SAMPLE_RATE
+
+
+@pytest.fixture
+def sustained_tone():
+    """sustained_tone(seconds, freq=440.0) -> (2, frames) float32 sine at samplerate."""
+    return _sustained_tone
+
+
+@pytest.fixture
+def level_dip():
+    """level_dip((channels, frames) audio, window=512) -> lowest/median short-term RMS."""
+    return _level_dip
@@ -1,11 +1,21 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from services.audio_processor import AudioProcessor
 from services.smart_mixer import SmartMixer
+from services.job_queue import JobQueue
+from services.pitch_shifter import StemPitchShifter
+from services.preview_streamer import PreviewStreamer
+from services.alignment_store import AlignmentStore
+from services.media_io import MediaTooLarge, UnsupportedMedia, download_to_file, save_upload
+from services.subtitle_parser import from_word_dicts, to_json_columns
+import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 app = FastAPI(title="Vocalize Backend", version="0.1.0")
 
@@ -24,10 +34,26 @@ app.mount("/audio", StaticFiles(directory="temp_audio"), name="audio")
 
 processor = AudioProcessor(output_dir="temp_audio")
 mixer = SmartMixer()
+job_queue = JobQueue()
+pitch_shifter = StemPitchShifter(mixer, processor.stem_cache)
+preview_streamer = PreviewStreamer()
+# Batch mixes fan out here (Pedalboard releases the GIL while processing)
+mix_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("MIX_WORKERS", os.cpu_count() or 4)), thread_name_prefix="mix")
+# Recording offsets, applied while streaming instead of padding files
+alignments = AlignmentStore(root="temp_audio")
+
+@app.on_event("startup")
+def preload_models():
+    # Warm the models so the first /process or /transcribe doesn't pay the load
+    if os.environ.get("PRELOAD_DEMUCS") == "true":
+        processor.separator.load()
+    if os.environ.get("PRELOAD_WHISPER") == "true":
+        processor.transcriber.preload()
 
 class ProcessRequest(BaseModel):
     youtube_url: str = None
     audio_url: str = None
+    prerender_semitones: int = None # Render ±N transposes in the background after separation
 
 class MixRequest(BaseModel):
     input_path: str # Relative path like "temp_audio/recording.wav"
@@ -36,102 +62,216 @@ class MixRequest(BaseModel):
 
 class AutotuneRequest(BaseModel):
     input_path: str
-    key: str
-    semitones: float
+    key: str # e.g. "C Major", as returned by /process
+    strength: float = 1.0 # 0-1: how far notes are pulled onto the scale
+    semitones: float = 0.0 # Fixed transpose applied on top of the correction
+    retune_ms: float = 60.0 # How quickly the correction follows the singer
+
+def run_process_pipeline(request: ProcessRequest, set_state) -> dict:
+    """
+    Download -> key -> separation. Runs on the job pool, never on the event loop.
+    """
+    # Check for Cloud Flag
+    if os.environ.get("USE_CLOUD_PROCESSING") == "true":
+        print("Using Cloud Processing (Modal)...")
+        try:
+            import modal
+            set_state("separating")
+            f = modal.Function.lookup("vocalize-cloud", "process_audio_cloud")
+            result = f.remote(request.youtube_url, request.audio_url)
+            return result
+        except ImportError:
+            print("Modal not installed. Falling back to local.")
+        except Exception as e:
+            print(f"Cloud processing failed: {e}. Falling back to local.")
+
+    # 1. Download
+    set_state("downloading")
+    prefetch = {}
+    if request.youtube_url:
+        print(f"Downloading {request.youtube_url}...")
+        # Start the lyrics lookup as soon as the title is known; it overlaps download + Demucs
+        on_info = None
+        if os.environ.get("LYRICS_PREFETCH") != "false":
+            def on_info(info, track_name):
+                prefetch["lyrics"] = processor.prefetch_lyrics(track_name)
+        file_path = processor.download_youtube(request.youtube_url, on_info=on_info)
+    else:
+        print(f"Downloading from URL {request.audio_url}...")
+        # Streamed to a unique file, capped at MAX_MEDIA_MB
+        file_path = download_to_file(request.audio_url, "temp_audio", prefix="upload")
+
+    # 2. Detect Key + 3. Separate Stems (one decode, run side by side)
+    set_state("key")
+    print("Detecting key and separating stems...")
+    key_info, stems = processor.detect_key_and_separate(
+        file_path, on_separating=lambda: set_state("separating")
+    )
+
+    # Analyze the reference vocals now so /mix only does a lookup
+    if "vocals" in stems:
+        mixer.features.prefetch(stems["vocals"])
+
+    # Align the prefetched lyrics (or subtitles) now, so /transcribe is a cache hit.
+    # Only YouTube tracks have a real title to look lyrics up by
+    if os.environ.get("LYRICS_PREFETCH") != "false" and request.youtube_url and "vocals" in stems:
+        processor.prefetch_transcript(stems["vocals"], lyrics_future=prefetch.get("lyrics"))
+
+    # Warm the transpose slider: render ±N semitone variants in the background
+    prerender = request.prerender_semitones
+    if prerender is None:
+        prerender = int(os.environ.get("PRERENDER_SEMITONES", 0))
+    if prerender > 0:
+        pitch_shifter.prerender(stems, prerender)
+
+    # Convert absolute paths to relative URLs
+    base_url = "http://localhost:8000/audio"
+    stems_urls = {k: f"{base_url}/{os.path.relpath(v, 'temp_audio')}" for k, v in stems.items()}
+
+    return {
+        "status": "success",
+        "key": key_info["key"],
+        "key_confidence": key_info["confidence"],
+        "key_runner_up": key_info["runner_up"],
+        "stems": stems_urls,
+        "original_file": f"{base_url}/{os.path.basename(file_path)}"
+    }
 
 @app.post("/process")
 async def process_audio(request: ProcessRequest):
-    try:
-        # Check for Cloud Flag
-        if os.environ.get("USE_CLOUD_PROCESSING") == "true":
-            print("Using Cloud Processing (Modal)...")
-            try:
-                import modal
-                f = modal.Function.lookup("vocalize-cloud", "process_audio_cloud")
-                result = f.remote(request.youtube_url, request.audio_url)
-                return result
-            except ImportError:
-                print("Modal not installed. Falling back to local.")
-            except Exception as e:
-                print(f"Cloud processing failed: {e}. Falling back to local.")
-
-        # 1. Download
-        if request.youtube_url:
-            print(f"Downloading {request.youtube_url}...")
-            file_path = processor.download_youtube(request.youtube_url)
-        elif request.audio_url:
-            print(f"Downloading from URL {request.audio_url}...")
-            # We need a method to download from URL. 
-            # For now, let's assume processor has it or we add it.
-            # Actually, let's just use requests/urllib here or add to processor.
-            import requests
-            response = requests.get(request.audio_url)
-            file_path = os.path.join("temp_audio", "uploaded_file.wav") # simplified
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-        else:
-            raise HTTPException(status_code=400, detail="No URL provided")
-        
-        # 2. Detect Key
-        print("Detecting key...")
-        key = processor.detect_key(file_path)
-        
-        # 3. Separate Stems
-        print("Separating stems...")
-        stems = processor.separate_stems(file_path)
-        
-        # Convert absolute paths to relative URLs
-        base_url = "http://localhost:8000/audio"
-        stems_urls = {k: f"{base_url}/{os.path.relpath(v, 'temp_audio')}" for k, v in stems.items()}
-        
-        return {
-            "status": "success",
-            "key": key,
-            "stems": stems_urls,
-            "original_file": f"{base_url}/{os.path.basename(file_path)}"
-        }
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if not request.youtube_url and not request.audio_url:
+        raise HTTPException(status_code=400, detail="No URL provided")
+
+    # Queue the work and return right away; poll GET /jobs/{job_id} for the result
+    job = job_queue.submit(
+        lambda set_state: run_process_pipeline(request, set_state),
+        payload=request.dict()
+    )
+    return {
+        "status": "queued",
+        "job_id": job["id"],
+        "state": job["state"]
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def mix_take(input_path: str, params: dict, strength: float, tag: str = "") -> dict:
+    """Mixes one take with already-analyzed reference params; keeps its alignment."""
+    input_full = os.path.abspath(input_path)
+    output_filename = f"mixed_{tag}{os.path.basename(input_full)}"
+    output_full = os.path.join("temp_audio", output_filename)
+
+    started = time.perf_counter()
+    mixer.apply_mix(input_full, output_full, params, strength)
+    # The processed take sits at the same place in the song as the original
+    offset = alignments.get(input_full)
+    if offset:
+        alignments.set(output_full, offset)
+
+    return {
+        "output_url": f"http://localhost:8000/audio/{output_filename}",
+        "offset": offset,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
 
 @app.post("/mix")
 async def mix_audio(request: MixRequest):
     try:
-        # Resolve paths
-        input_full = os.path.abspath(request.input_path)
-        ref_full = os.path.abspath(request.reference_path)
-        output_filename = f"mixed_{os.path.basename(input_full)}"
-        output_full = os.path.join("temp_audio", output_filename)
-        
-        # Analyze
+        # Analyze (stored per reference, so usually a lookup)
         print("Analyzing reference...")
-        params = mixer.analyze_reference(ref_full)
+        params = mixer.analyze_reference(os.path.abspath(request.reference_path))
         
         # Apply
         print("Applying mix...")
-        mixer.apply_mix(input_full, output_full, params, request.strength)
+        result = mix_take(request.input_path, params, request.strength)
         
         return {
             "status": "success",
-            "output_url": f"http://localhost:8000/audio/{output_filename}"
+            "output_url": result["output_url"],
+            "offset": result["offset"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class BatchTake(BaseModel):
+    input_path: str
+    strength: Optional[float] = None # Defaults to the batch strength
+
+class BatchMixRequest(BaseModel):
+    reference_path: str
+    takes: list[BatchTake]
+    strength: float = 1.0
+
+@app.post("/mix/batch")
+def mix_batch(request: BatchMixRequest):
+    """
+    Mixes several takes against one reference: the reference is analyzed
+    once and the takes run in parallel on the mix pool. A failed take is
+    reported in its own entry instead of failing the batch.
+    """
+    try:
+        started = time.perf_counter()
+        params = mixer.analyze_reference(os.path.abspath(request.reference_path))
+        analysis_seconds = time.perf_counter() - started
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Identical (take, strength) pairs are only mixed once. Every other pair
+    # gets its own output, named after a hash of the pair: takes from different
+    # projects share basenames like vocals.wav, and close strengths would
+    # round to the same label
+    futures = {}
+    for take in request.takes:
+        strength = float(request.strength if take.strength is None else take.strength)
+        key = (os.path.abspath(take.input_path), strength)
+        if key not in futures:
+            tag = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=4).hexdigest()
+            futures[key] = mix_pool.submit(mix_take, take.input_path, params, strength, f"{tag}_")
+
+    results = []
+    for take in request.takes:
+        strength = float(request.strength if take.strength is None else take.strength)
+        future = futures[(os.path.abspath(take.input_path), strength)]
+        entry = {"input_path": take.input_path, "strength": strength}
+        try:
+            entry.update(status="success", **future.result())
+        except Exception as e:
+            print(f"Mix failed for {take.input_path}: {e}")
+            entry.update(status="error", error=str(e))
+        results.append(entry)
+
+    return {
+        "status": "success",
+        "reference_seconds": round(analysis_seconds, 3),
+        "total_seconds": round(time.perf_counter() - started, 3),
+        "takes": results
+    }
+
 @app.post("/autotune")
-async def autotune_audio(request: AutotuneRequest):
+def autotune_audio(request: AutotuneRequest):
     try:
         input_full = os.path.abspath(request.input_path)
         output_filename = f"tuned_{os.path.basename(input_full)}"
         output_full = os.path.join("temp_audio", output_filename)
         
-        print(f"Shifting pitch by {request.semitones} semitones...")
-        mixer.apply_autotune(input_full, output_full, request.key, request.semitones)
+        print(f"Correcting pitch to {request.key} (strength {request.strength}, {request.semitones:+g} semitones)...")
+        result = mixer.apply_autotune(
+            input_full, output_full, request.key, request.strength, request.semitones, request.retune_ms
+        )
+        offset = alignments.get(input_full)
+        if offset:
+            alignments.set(output_full, offset)
         
         return {
             "status": "success",
-            "output_url": f"http://localhost:8000/audio/{output_filename}"
+            "output_url": f"http://localhost:8000/audio/{output_filename}",
+            "offset": offset,
+            "mean_correction": result["mean_correction"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -141,11 +281,11 @@ class PitchShiftRequest(BaseModel):
     semitones: int
 
 @app.post("/pitch_shift_stems")
-async def pitch_shift_stems(request: PitchShiftRequest):
+def pitch_shift_stems(request: PitchShiftRequest):
     try:
-        shifted_stems = {}
         print(f"Shifting stems by {request.semitones} semitones...")
         
+        input_paths = {}
         for name, url in request.stems.items():
             # Extract relative path from URL (e.g., http://localhost:8000/audio/...)
             # We assume the URL structure matches what we serve
@@ -159,18 +299,17 @@ async def pitch_shift_stems(request: PitchShiftRequest):
             if not os.path.exists(input_path):
                 print(f"File not found: {input_path}")
                 continue
-                
-            # Create output filename
-            base, ext = os.path.splitext(input_path)
-            output_path = f"{base}_shifted_{request.semitones}{ext}"
-            
-            # Apply pitch shift
-            # We use apply_autotune which wraps Pedalboard's PitchShift
-            mixer.apply_autotune(input_path, output_path, key="C", strength=request.semitones)
-            
-            # Construct new URL
-            new_rel_path = os.path.relpath(output_path, "temp_audio")
-            shifted_stems[name] = f"http://localhost:8000/audio/{new_rel_path}"
+
+            input_paths[name] = input_path
+
+        # Stems render concurrently; repeated (stem, semitones) pairs are cache hits
+        shifted_paths = pitch_shifter.shift_stems(input_paths, request.semitones)
+
+        # Construct new URLs
+        shifted_stems = {
+            name: f"http://localhost:8000/audio/{os.path.relpath(path, 'temp_audio')}"
+            for name, path in shifted_paths.items()
+        }
             
         return {
             "status": "success",
@@ -180,34 +319,86 @@ async def pitch_shift_stems(request: PitchShiftRequest):
         print(f"Pitch shift error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/preview")
+def preview_stem(url: str, semitones: float = 0, offset: float = 0, gain: float = 1.0, format: str = "wav"):
+    """
+    Streams a stem with the transpose applied block by block (chunked transfer).
+    Seek with offset (seconds). format: "wav" (streaming WAV) or "pcm" (raw s16le).
+    Aligned recordings play silence until their stored offset.
+    """
+    if "/audio/" in url:
+        rel_path = url.split("/audio/")[1].replace("%20", " ")
+        input_path = os.path.join("temp_audio", rel_path)
+    else:
+        raise HTTPException(status_code=400, detail="Invalid audio URL")
+
+    if not os.path.exists(input_path):
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
+    try:
+        chunks, media_type, headers = preview_streamer.open(
+            input_path, semitones, offset, gain, format, delay=alignments.get(input_path)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
 from fastapi import UploadFile, File, Form
-import shutil
+from pathlib import Path
 
 @app.post("/align_recording")
 async def align_recording(
     file: UploadFile = File(...),
-    start_time: float = Form(...)
+    start_time: float = Form(...),
+    render: bool = Form(False),
+    reference_path: str = Form(None),
+    search_seconds: float = Form(1.0)
 ):
+    """
+    Stores where a recording starts in the song. Mix, preview and export apply
+    the offset while streaming; render=true also writes a padded copy.
+    With reference_path (the song's vocals.wav), the offset is measured by
+    cross-correlation within search_seconds of start_time, which removes the
+    browser's recording latency; start_time is kept if the match is weak.
+    """
     try:
-        # Save uploaded file temporarily
-        temp_input = os.path.join("temp_audio", f"temp_{file.filename}")
-        with open(temp_input, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Output path
-        output_filename = f"aligned_{file.filename}"
-        output_path = os.path.join("temp_audio", output_filename)
-        
-        print(f"Aligning recording: start_time={start_time}s")
-        
-        # Use SmartMixer (or new method) to pad with silence
-        # We'll add a helper in SmartMixer for this
-        mixer.align_audio(temp_input, output_path, start_time)
-        
-        return {
+        # Stream the upload to a unique temp file (never the client's filename)
+        temp_input = save_upload(file.file, "temp_audio", prefix="recording", content_type=file.content_type)
+
+        output_filename = f"aligned_{Path(temp_input).stem}.wav"
+        output_path = os.path.join("temp_audio", output_filename) if render else None
+        estimate = None
+        if reference_path:
+            ref_full = os.path.abspath(reference_path)
+            if not os.path.exists(ref_full):
+                raise HTTPException(status_code=404, detail="Reference file not found")
+            estimate = mixer.auto_align(temp_input, ref_full, start_time, output_path, search_seconds=search_seconds)
+            offset = estimate["applied"]
+        else:
+            offset = start_time
+            if render:
+                mixer.align_audio(temp_input, output_path, offset)
+        alignments.set(temp_input, offset)
+        print(f"Aligned recording {temp_input}: offset={offset:.3f}s (client start_time={start_time}s)")
+
+        result = {
             "status": "success",
-            "url": f"http://localhost:8000/audio/{output_filename}"
+            "url": f"http://localhost:8000/audio/{os.path.basename(temp_input)}",
+            "offset": offset
         }
+        if estimate:
+            result["measured_offset"] = estimate["offset"]
+            result["latency"] = estimate["latency"]
+            result["confidence"] = estimate["confidence"]
+        if render:
+            result["aligned_url"] = f"http://localhost:8000/audio/{output_filename}"
+        return result
+    except HTTPException:
+        raise
+    except MediaTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedMedia as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         print(f"Alignment error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -220,8 +411,13 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+def cache_stats():
+    return processor.stem_cache.stats()
+
 class TranscribeRequest(BaseModel):
     audio_url: str
+    format: str = "words" # "columns" returns {words, starts, ends} lists (smaller payload)
 
 # Project Management Endpoints
 from services.project_manager import ProjectManager
@@ -249,6 +445,8 @@ class ExportRequest(BaseModel):
     volumes: dict
     pitch_shift: float
     format: str = "mp3"
+    pitch_mode: str = "bus" # "bus" (shift the mix once) or "stems" (shift each stem)
+    offsets: dict = None # stem name -> seconds; defaults to each file's stored alignment
 
 @app.post("/export")
 async def export_audio(request: ExportRequest):
@@ -265,11 +463,16 @@ async def export_audio(request: ExportRequest):
                 # Assume it's already a path or invalid
                 local_stems[name] = url
 
+        offsets = {name: alignments.get(path) for name, path in local_stems.items()}
+        offsets.update(request.offsets or {})
+
         output_path = export_service.mix_and_export(
             local_stems,
             request.volumes,
             request.pitch_shift,
-            request.format
+            request.format,
+            request.pitch_mode,
+            offsets
         )
         if output_path and os.path.exists(output_path):
             return FileResponse(output_path, filename=os.path.basename(output_path), media_type=f"audio/{request.format}")
@@ -279,7 +482,7 @@ async def export_audio(request: ExportRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/transcribe")
-async def transcribe_audio(request: TranscribeRequest):
+def transcribe_audio(request: TranscribeRequest):
     try:
         # Extract relative path from URL
         if "/audio/" in request.audio_url:
@@ -292,11 +495,17 @@ async def transcribe_audio(request: TranscribeRequest):
             raise HTTPException(status_code=404, detail="Audio file not found")
             
         print(f"Transcribing {input_path}...")
-        lyrics = processor.transcribe_audio(input_path)
+        result = processor.transcribe_audio_detailed(input_path)
         
+        lyrics = result["words"]
+        if request.format == "columns":
+            lyrics = to_json_columns(from_word_dicts(lyrics))
+
         return {
             "status": "success",
-            "lyrics": lyrics
+            "lyrics": lyrics,
+            "source": result.get("source"),
+            "language": result.get("language")
         }
     except Exception as e:
         print(f"Transcription error: {e}")
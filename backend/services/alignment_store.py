@@ -0,0 +1,38 @@
+import json
+import os
+import threading
+
+from services.atomic_json import write_json
+
+
+class AlignmentStore:
+    """
+    Alignment offsets for recordings, in seconds, kept in
+    temp_audio/alignments.json instead of being baked into the audio.
+    Positive means the recording starts that far into the song; mix, preview
+    and export apply it while streaming.
+    """
+
+    def __init__(self, root="temp_audio"):
+        self.root = root
+        self.path = os.path.join(root, "alignments.json")
+        self._lock = threading.Lock()
+        self.offsets = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.offsets = json.load(f)
+            except Exception as e:
+                print(f"Error loading alignments: {e}")
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+
+    def get(self, path) -> float:
+        with self._lock:
+            return float(self.offsets.get(self._key(path), 0.0))
+
+    def set(self, path, offset_seconds: float):
+        with self._lock:
+            self.offsets[self._key(path)] = float(offset_seconds)
+            write_json(self.path, self.offsets)
@@ -0,0 +1,21 @@
+import json
+import os
+import tempfile
+
+
+def write_json(path: str, data):
+    """
+    Writes data as JSON to path atomically: readers see the old file or the
+    new one, never a partial write. The temp file is unique, so concurrent
+    writers of the same path don't trip over each other's rename.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -1,34 +1,88 @@
 import os
 import yt_dlp
-import demucs.separate
-import librosa
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import shlex
-import subprocess
 from pathlib import Path
 import json
-import webvtt
+from services.separation_engine import get_separation_engine
+from services.stem_cache import StemCache, fingerprint_array, fingerprint_audio_file
+from services.transcript_cache import SubtitleIndex, TranscriptCache
+from services.download_index import DownloadIndex
+from services.media_io import is_generated_name
+from services.key_detector import KeyDetector
+from services.keyed_locks import KeyedLocks
+from services.transcription_service import get_transcription_service
+from services.lyrics_aligner import LyricsAligner
+from services.lyrics_scraper import LyricsScraper
+from services.subtitle_parser import parse_vtt, to_word_dicts
+
+def clean_track_name(track_name: str) -> str:
+    """
+    Turns a video title into a lyrics search query
+    (drops "Lyric Video" etc. and everything after | or -).
+    """
+    # Clean track name (remove "Lyric Video", etc.)
+    # 1. Remove common suffixes
+    clean_name = track_name.replace("Lyric Video", "").replace("Official Video", "").replace("Video Song", "")
+    # 2. Split by | and take first part
+    if "｜" in clean_name: # Full-width pipe
+        clean_name = clean_name.split("｜")[0]
+    if "|" in clean_name: # Normal pipe
+        clean_name = clean_name.split("|")[0]
+    # 3. Split by - and take first part (often Artist - Title or Title - Artist)
+    # But sometimes it's "Title - Movie", so taking first part is usually safe for lyrics search
+    if "-" in clean_name:
+        clean_name = clean_name.split("-")[0]
+    return clean_name.strip()
 
 class AudioProcessor:
     def __init__(self, output_dir="temp_audio"):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
-        self.last_subtitle_path = None # Initialize subtitle path
+        self.separator = get_separation_engine("htdemucs")
+        self.stem_cache = StemCache(root=str(self.output_dir))
+        self.transcriber = get_transcription_service()
+        self.transcripts = TranscriptCache(root=str(self.output_dir))
+        self.subtitle_index = SubtitleIndex(root=str(self.output_dir))
+        self.download_index = DownloadIndex(root=str(self.output_dir))
+        self.aligner = LyricsAligner()
+        # Pooled session + on-disk lookup cache, shared by every /transcribe
+        self.lyrics_scraper = LyricsScraper(cache_dir=os.path.join(str(self.output_dir), "lyrics_cache"))
+        # Lyrics work started by /process ahead of /transcribe
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lyrics-prefetch")
+        # One transcription per track (content hash) at a time
+        self._transcribe_locks = KeyedLocks()
+        excerpts = int(os.environ.get("KEY_EXCERPTS", 8))
+        self.key_detector = KeyDetector(
+            method=os.environ.get("KEY_METHOD", "stft"),
+            excerpts=excerpts or None,
+        )
 
-    def download_youtube(self, url: str) -> str:
+    def download_youtube(self, url: str, on_info=None) -> str:
         """
         Downloads audio from YouTube URL.
+        The native audio stream (opus/m4a) is kept as is; the decoder reads it
+        directly, so there is no WAV transcode. Videos downloaded before are
+        served from the download index without touching the network.
+        on_info(info, track_name) is called once the metadata is known,
+        before the audio itself is downloaded.
         Returns the path to the downloaded file.
         """
+        cached = self.download_index.lookup(url)
+        if cached:
+            print(f"Already downloaded: {cached['path']}")
+            if on_info:
+                on_info({"title": cached["title"]}, cached["track_name"])
+            return cached["path"]
+
         # Download options
         ydl_opts = {
             'format': 'bestaudio/best',
             'outtmpl': os.path.join(self.output_dir, '%(title)s.%(ext)s'),
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'wav',
-                'preferredquality': '192',
-            }],
+            # DASH/HLS fragments in parallel; partial downloads resume
+            'concurrent_fragment_downloads': int(os.environ.get("YTDLP_FRAGMENTS", 4)),
+            'continuedl': True,
+            'retries': 3,
             # Attempt to download subtitles, but don't fail if missing
             'writesubtitles': True,
             'writeautomaticsub': True,
@@ -43,98 +97,100 @@ class AudioProcessor:
         }
 
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            # FFmpeg conversion changes extension to .wav
-            final_path = os.path.splitext(filename)[0] + ".wav"
-            
-            if not os.path.exists(final_path):
+            # Metadata first, so callers can start title-based work during the download
+            info = ydl.extract_info(url, download=False)
+            track_name = Path(ydl.prepare_filename(info)).stem
+            if on_info:
+                on_info(info, track_name)
+            info = ydl.process_ie_result(info, download=True)
+
+            downloads = info.get('requested_downloads') or []
+            final_path = downloads[0].get('filepath') if downloads else ydl.prepare_filename(info)
+            if not final_path or not os.path.exists(final_path):
                 raise Exception(f"Download failed: File {final_path} not found")
-            
-            # Store subtitle path if it exists
-            self.last_subtitle_path = None
-            base_path = os.path.splitext(filename)[0]
-            
-            # Check for any vtt file with the same base name
-            for f in os.listdir(self.output_dir):
-                if f.endswith(".vtt") and os.path.splitext(f)[0].startswith(os.path.basename(base_path)):
-                    self.last_subtitle_path = os.path.join(self.output_dir, f)
-                    break
-                    
+
+            # yt-dlp reports exactly which subtitle files it wrote
+            subtitles = {}
+            for language, sub in (info.get('requested_subtitles') or {}).items():
+                vtt_path = sub.get('filepath')
+                if vtt_path and os.path.exists(vtt_path):
+                    subtitles[language] = vtt_path
+                    self.subtitle_index.register(track_name, vtt_path, language)
+
+            self.download_index.record(url, final_path, info.get('title'), track_name, subtitles)
             return final_path
 
-    def separate_stems(self, audio_path: str) -> dict:
+    def decode_audio(self, audio_path: str):
+        """
+        Decodes the track once at the separator's rate/channels.
+        The buffer is shared by key detection and separation.
+        """
+        return self.separator.load_audio(audio_path)
+
+    def separate_stems(self, audio_path: str, wav=None) -> dict:
         """
         Separates audio into 4 stems (vocals, drums, bass, other) using Demucs.
+        Pass wav (from decode_audio) to skip decoding the file again.
         Returns a dictionary of paths to the stems.
         """
-        # Using the demucs command line interface via subprocess for simplicity
-        # as the API can be complex to set up with model loading in the same process
-        # if not managed carefully.
-        
-        # Output structure of demucs: <out>/htdemucs/<track_name>/<stem>.wav
-        
+        separator = self.separator
+        if wav is None:
+            wav = separator.load_audio(audio_path)
+
+        # Cache key: decoded audio + model + separation settings (not the title)
+        cache_key = StemCache.make_key(
+            fingerprint_array(wav.numpy()),
+            separator.model_name,
+            {"segment": separator.segment, "overlap": separator.overlap, "shifts": separator.shifts},
+        )
+        cached = self.stem_cache.lookup(cache_key)
+        if cached:
+            print(f"Stem cache hit for {Path(audio_path).name}, skipping separation.")
+            return cached
+
+        # Output structure (same as the demucs CLI): <out>/htdemucs/<track_name>/<stem>.wav
         track_name = Path(audio_path).stem
-        stem_dir = self.output_dir / "htdemucs" / track_name
-        
-        # Check if stems already exist
-        vocals_path = stem_dir / "vocals.wav"
-        drums_path = stem_dir / "drums.wav"
-        bass_path = stem_dir / "bass.wav"
-        other_path = stem_dir / "other.wav"
-        
-        if vocals_path.exists() and drums_path.exists() and bass_path.exists() and other_path.exists():
-            print(f"Stems already exist for {track_name}, skipping separation.")
-            return {
-                "vocals": str(vocals_path),
-                "drums": str(drums_path),
-                "bass": str(bass_path),
-                "other": str(other_path)
-            }
-        
-        # Use sys.executable to ensure we use the venv's python and demucs module
-        import sys
-        cmd = [sys.executable, "-m", "demucs", "-n", "htdemucs", "--out", str(self.output_dir), str(audio_path)]
-        subprocess.run(cmd, check=True)
-        
-        return {
-            "vocals": str(vocals_path),
-            "drums": str(drums_path),
-            "bass": str(bass_path),
-            "other": str(other_path)
-        }
+        stem_dir = self.output_dir / separator.model_name / track_name
+        if stem_dir.exists() and any(stem_dir.iterdir()):
+            # A different song already owns this title; keep both
+            stem_dir = self.output_dir / separator.model_name / f"{track_name}_{cache_key[:8]}"
+
+        # Separate in-process with the warm, shared model
+        stems = separator.separate(wav, stem_dir)
+        self.stem_cache.store(cache_key, stems, {"track": track_name, "model": separator.model_name})
+        return stems
 
     def detect_key(self, audio_path: str) -> str:
         """
         Detects the key of the audio using Librosa Chroma features.
         """
-        y, sr = librosa.load(audio_path)
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-        
-        # Sum chroma over time
-        chroma_sum = np.sum(chroma, axis=1)
-        
-        # Major and Minor profiles
-        major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-        minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-        
-        # Correlate
-        major_corrs = []
-        minor_corrs = []
-        
-        for i in range(12):
-            major_corrs.append(np.corrcoef(np.roll(chroma_sum, -i), major_profile)[0, 1])
-            minor_corrs.append(np.corrcoef(np.roll(chroma_sum, -i), minor_profile)[0, 1])
-            
-        key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-        
-        best_major_idx = np.argmax(major_corrs)
-        best_minor_idx = np.argmax(minor_corrs)
-        
-        if major_corrs[best_major_idx] > minor_corrs[best_minor_idx]:
-            return f"{key_names[best_major_idx]} Major"
-        else:
-            return f"{key_names[best_minor_idx]} Minor"
+        return self.key_detector.detect_file(audio_path)["key"]
+
+    def detect_key_from_array(self, y: np.ndarray, sr: int) -> dict:
+        """
+        Key detection for audio that is already decoded.
+        Accepts mono (samples,) or multichannel (channels, samples) input.
+        Returns {key, confidence, runner_up, runner_up_confidence}.
+        """
+        return self.key_detector.detect(y, sr)
+
+    def detect_key_and_separate(self, audio_path: str, on_separating=None):
+        """
+        Decodes the track once, then runs key detection alongside Demucs.
+        Wall-clock time is roughly max(key, separation) instead of the sum.
+        Returns (key details, stems).
+        """
+        wav = self.decode_audio(audio_path)
+        mono = wav.mean(0).numpy()
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="key") as pool:
+            key_future = pool.submit(self.detect_key_from_array, mono, self.separator.samplerate)
+            if on_separating:
+                on_separating()
+            stems = self.separate_stems(audio_path, wav=wav)
+            key = key_future.result()
+
+        return key, stems
 
     def google_search_key_validation(self, song_name: str) -> str:
         """
@@ -150,149 +206,159 @@ class AudioProcessor:
         Prioritizes YouTube subtitles if available (fast & accurate).
         Falls back to OpenAI Whisper (slower).
         """
+        return self.transcribe_audio_detailed(audio_path)["words"]
+
+    def transcribe_audio_detailed(self, audio_path: str) -> dict:
+        """
+        Same as transcribe_audio, but returns {words, source, language}.
+        Results are cached by the vocals file's content hash, so repeat calls
+        are a single lookup.
+        """
+        return self._transcribe_cached(audio_path, whisper=True)
+
+    def _transcribe_cached(self, audio_path: str, whisper: bool) -> dict:
+        content_hash = fingerprint_audio_file(audio_path)
+        # One transcription per track at a time; a second caller waits for the cache
+        with self._transcribe_locks.hold(content_hash):
+            cached = self.transcripts.get(content_hash)
+            if cached and not (whisper and self._whisper_alignment_pending(cached)):
+                print(f"Using cached lyrics ({cached.get('source')}) for {audio_path}")
+                return cached
+
+            result = self._transcribe_uncached(audio_path, whisper=whisper)
+            if result["words"]:
+                self.transcripts.put(content_hash, result)
+            return result
+
+    def _whisper_alignment_pending(self, cached: dict) -> bool:
+        """
+        True for web lyrics that were timed without a transcript (e.g. by the
+        prefetch, which never runs Whisper) while LYRICS_ALIGN_WHISPER=true:
+        the explicit path re-aligns them on a Whisper pass and replaces the entry.
+        """
+        return (cached.get("source") == "web"
+                and cached.get("timing") not in ("subtitles", "whisper")
+                and os.environ.get("LYRICS_ALIGN_WHISPER") == "true")
+
+    def prefetch_lyrics(self, track_name: str):
+        """
+        Starts the web lyrics lookup for a track in the background.
+        The scraper caches the result, so the later /transcribe doesn't search again.
+        """
+        if not track_name or is_generated_name(track_name):
+            return None
+        return self.prefetch_executor.submit(self.lyrics_scraper.fetch_lyrics, clean_track_name(track_name))
+
+    def prefetch_transcript(self, vocals_path: str, lyrics_future=None):
+        """
+        Fills the transcript cache in the background once the vocal stem exists,
+        from web lyrics or subtitles. Whisper is left for an explicit /transcribe.
+        Pass the prefetch_lyrics future to reuse that lookup instead of racing it.
+        """
+        def run():
+            try:
+                if lyrics_future is not None:
+                    lyrics_future.result()
+                result = self._transcribe_cached(vocals_path, whisper=False)
+                print(f"Prefetched lyrics ({result.get('source')}) for {vocals_path}")
+            except Exception as e:
+                print(f"Lyrics prefetch failed: {e}")
+        return self.prefetch_executor.submit(run)
+
+    def _transcribe_uncached(self, audio_path: str, whisper: bool = True) -> dict:
+        # audio_path is usually temp_audio/htdemucs/Title/vocals.wav
+        path_parts = Path(audio_path).parts
+        track_name = path_parts[-2] if "htdemucs" in path_parts else None
+
         # 0. Try Web Scraping (User Request: "Get from internet")
+        # Uploads only have a generated name like upload_<hex>; there is nothing to search for
         try:
-            # Extract track name from path (e.g., "Maruvaarthai...")
-            path_parts = Path(audio_path).parts
-            if "htdemucs" in path_parts:
-                track_name = path_parts[-2]
-                # Clean track name (remove "Lyric Video", etc.)
-                # 1. Remove common suffixes
-                clean_name = track_name.replace("Lyric Video", "").replace("Official Video", "").replace("Video Song", "")
-                # 2. Split by | and take first part
-                if "｜" in clean_name: # Full-width pipe
-                    clean_name = clean_name.split("｜")[0]
-                if "|" in clean_name: # Normal pipe
-                    clean_name = clean_name.split("|")[0]
-                # 3. Split by - and take first part (often Artist - Title or Title - Artist)
-                # But sometimes it's "Title - Movie", so taking first part is usually safe for lyrics search
-                if "-" in clean_name:
-                    clean_name = clean_name.split("-")[0]
-                
-                clean_name = clean_name.strip()
+            if track_name and not is_generated_name(track_name):
+                clean_name = clean_track_name(track_name)
                 
                 print(f"Attempting to fetch lyrics from web for: {clean_name}")
-                from services.lyrics_scraper import LyricsScraper
-                scraper = LyricsScraper()
-                web_lyrics, source_url = scraper.fetch_lyrics(clean_name)
+                web_lyrics, source_url = self.lyrics_scraper.fetch_lyrics(clean_name)
                 
                 if web_lyrics:
                     print(f"Found lyrics from web: {source_url}")
-                    # Convert to simple word list format for frontend compatibility
-                    # We don't have timestamps, so we'll fake them or just return words
-                    words = []
-                    for i, word in enumerate(web_lyrics.split()):
-                        words.append({
-                            "word": word,
-                            "start": i * 0.5, # Fake timing
-                            "end": (i * 0.5) + 0.4
-                        })
-                    return words
+                    # The text is known; align it to the vocal stem for word timings,
+                    # anchored on a timed transcript when there is one
+                    anchors, timing = self._alignment_words(track_name, audio_path, whisper)
+                    words = self.aligner.align(web_lyrics, audio_path, anchors)
+                    return {"words": words, "source": "web", "source_ref": source_url, "language": None, "timing": timing}
         except Exception as e:
             print(f"Web scraping failed: {e}")
 
-        # 1. Try parsing Subtitles
-        # Check in-memory path first
-        if hasattr(self, 'last_subtitle_path') and self.last_subtitle_path and os.path.exists(self.last_subtitle_path):
-            print(f"Using subtitles from {self.last_subtitle_path}")
-            return self._parse_vtt(self.last_subtitle_path)
-            
-        # Check on disk based on audio path
-        # audio_path is usually temp_audio/htdemucs/Title/vocals.wav
-        # VTT is usually temp_audio/Title.en.vtt
-        try:
-            path_parts = Path(audio_path).parts
-            if "htdemucs" in path_parts:
-                # Go up to temp_audio
-                # parts: (..., temp_audio, htdemucs, Title, vocals.wav)
-                track_name = path_parts[-2]
-                temp_dir = Path(audio_path).parents[2] # temp_audio
-                
-                # Look for VTT files starting with track_name
-                # Priority: .ta.vtt (Tamil) > .en.vtt (English) > .vtt (Generic)
-                temp_files = os.listdir(temp_dir)
-                
-                # 1. Check for Tamil VTT
-                for f in temp_files:
-                    if f.endswith(".ta.vtt") and f.startswith(track_name[:20]):
-                        vtt_path = os.path.join(temp_dir, f)
-                        print(f"Found Tamil VTT on disk: {vtt_path}")
-                        return self._parse_vtt(vtt_path)
-                        
-                # 2. Check for English/Generic VTT
-                for f in temp_files:
-                    if f.endswith(".vtt") and f.startswith(track_name[:20]):
-                        vtt_path = os.path.join(temp_dir, f)
-                        print(f"Found VTT on disk: {vtt_path}")
-                        return self._parse_vtt(vtt_path)
-        except Exception as e:
-            print(f"Error searching for VTT: {e}")
+        # 1. Try parsing Subtitles recorded for this track at download time
+        words, vtt_path, language = self._subtitle_words(track_name)
+        if words:
+            return {"words": words, "source": "subtitles", "source_ref": vtt_path, "language": language}
 
         # 2. Fallback to Whisper
+        if not whisper:
+            return {"words": [], "source": None, "source_ref": None, "language": None}
         print(f"No subtitles found. Using Whisper on {audio_path}...")
-        import whisper
         
         try:
-            # Load model (download on first run)
+            # The model stays resident after the first load
             # 'small' is better for isolated vocals than 'base'
-            print("Loading Whisper model (small)...")
-            model = whisper.load_model("small")
-            
-            # Transcribe with word timestamps
-            print("Starting transcription...")
-            result = model.transcribe(audio_path, word_timestamps=True)
-            print(f"Transcription complete. Segments: {len(result['segments'])}")
-            
-            # Process result into a flat list of words for easier frontend sync
-            words = []
-            for segment in result['segments']:
-                for word in segment['words']:
-                    words.append({
-                        'word': word['word'].strip(),
-                        'start': word['start'],
-                        'end': word['end']
-                    })
-            
-            print(f"Extracted {len(words)} words.")
-            return words
+            # Only the voiced parts of the stem are decoded (WHISPER_VAD=false turns this off)
+            # WHISPER_LONG_FORM=true/false forces overlapping-window mode on or off
+            long_form = os.environ.get("WHISPER_LONG_FORM")
+            result = self.transcriber.transcribe_vocals(
+                audio_path,
+                vad=os.environ.get("WHISPER_VAD") != "false",
+                long_form=None if long_form is None else long_form == "true",
+            )
+            print(f"Extracted {len(result['words'])} words.")
+            return {"words": result["words"], "source": "whisper", "source_ref": self.transcriber.model_size, "language": result["language"]}
         except Exception as e:
             print(f"Whisper error: {e}")
             import traceback
             traceback.print_exc()
-            return []
+            return {"words": [], "source": None, "source_ref": None, "language": None}
+
+    def _subtitle_words(self, track_name: str) -> tuple:
+        """
+        Words from the subtitles recorded for this track at download time,
+        as (words, vtt_path, language); ([], None, None) if there are none.
+        Priority: .ta.vtt (Tamil) > .en.vtt (English) > any other
+        """
+        if track_name:
+            subtitles = self.subtitle_index.lookup(track_name)
+            for language in ["ta", "en", *subtitles]:
+                vtt_path = subtitles.get(language)
+                if vtt_path:
+                    print(f"Using subtitles from {vtt_path}")
+                    words = self._parse_vtt(vtt_path)
+                    if words:
+                        return words, vtt_path, language
+        return [], None, None
+
+    def _alignment_words(self, track_name: str, audio_path: str, whisper: bool) -> tuple:
+        """
+        Timed words to DTW-align web lyrics against, as (words, timing source):
+        the track's subtitles, or (with LYRICS_ALIGN_WHISPER=true) a Whisper
+        pass. (None, "energy") leaves the aligner on the vocal stem's energy alone.
+        """
+        words, _, _ = self._subtitle_words(track_name)
+        if words:
+            return words, "subtitles"
+        if whisper and os.environ.get("LYRICS_ALIGN_WHISPER") == "true":
+            try:
+                return self.transcriber.transcribe_vocals(audio_path)["words"], "whisper"
+            except Exception as e:
+                print(f"Whisper pass for alignment failed: {e}")
+        return None, "energy"
 
     def _parse_vtt(self, vtt_path: str) -> list:
         """
         Parses a VTT subtitle file into word-level chunks.
-        Note: VTT usually gives line-level timestamps. We will split lines into words
-        and interpolate timestamps for a smoother effect, or just return lines.
-        For Karaoke, line-level is often okay, but we want word-level if possible.
+        Line timings are spread evenly over each line's words (YouTube's inline
+        word timestamps are used when present), and rolling-caption repeats are dropped.
         """
-        words = []
-        
         try:
-            for caption in webvtt.read(vtt_path):
-                start = caption.start_in_seconds
-                end = caption.end_in_seconds
-                text = caption.text.strip()
-                
-                # Split into words and distribute time evenly
-                # This is an approximation but much faster than Whisper
-                caption_words = text.split()
-                if not caption_words:
-                    continue
-                    
-                duration = end - start
-                word_duration = duration / len(caption_words)
-                
-                for i, word in enumerate(caption_words):
-                    words.append({
-                        'word': word,
-                        'start': start + (i * word_duration),
-                        'end': start + ((i + 1) * word_duration)
-                    })
+            return to_word_dicts(parse_vtt(vtt_path))
         except Exception as e:
             print(f"Error parsing VTT: {e}")
             return []
-            
-        return words
@@ -0,0 +1,313 @@
+import subprocess
+
+import numpy as np
+from pedalboard.io import AudioFile
+from scipy import ndimage, signal
+
+# ~1.5 s at 44.1 kHz: large enough to amortize plugin calls, small enough to keep memory flat
+BLOCK_FRAMES = 1 << 16
+
+# ffmpeg arguments per export container
+ENCODER_ARGS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"],
+    "mp4": ["-c:a", "aac", "-b:a", "192k", "-f", "mp4"],
+    "wav": ["-c:a", "pcm_s16le", "-f", "wav"],
+}
+
+
+def open_audio(path: str, samplerate: float = None):
+    """Opens a file for block reading, resampled on the fly if samplerate differs."""
+    f = AudioFile(path)
+    if samplerate and f.samplerate != samplerate:
+        return f.resampled_to(samplerate)
+    return f
+
+
+def match_channels(block: np.ndarray, channels: int) -> np.ndarray:
+    """Up/down-mixes a (channels, frames) block to the requested channel count."""
+    if block.shape[0] == channels:
+        return block
+    if block.shape[0] == 1:
+        return np.repeat(block, channels, axis=0)
+    if channels == 1:
+        return block.mean(axis=0, keepdims=True)
+    return block[:channels]
+
+
+def read_blocks(reader, block_frames: int = BLOCK_FRAMES):
+    """Yields (channels, frames) float32 blocks from an open AudioFile."""
+    while reader.tell() < reader.frames:
+        block = reader.read(block_frames)
+        if block.shape[1] == 0:
+            break
+        yield block
+
+
+def offset_blocks(blocks, frames: int, channels: int, block_frames: int = BLOCK_FRAMES):
+    """
+    Shifts a block stream in time without touching the file: frames > 0
+    plays that much silence first, frames < 0 drops that many leading frames.
+    """
+    if frames > 0:
+        silence = np.zeros((channels, min(frames, block_frames)), dtype=np.float32)
+        while frames > 0:
+            n = min(frames, block_frames)
+            yield silence[:, :n]
+            frames -= n
+    skip = -frames
+    for block in blocks:
+        if skip:
+            if block.shape[1] <= skip:
+                skip -= block.shape[1]
+                continue
+            block = block[:, skip:]
+            skip = 0
+        yield block
+
+
+def rechunk(blocks, block_frames: int = BLOCK_FRAMES):
+    """
+    Re-slices a stream of variable-length blocks into exactly block_frames
+    (last may be shorter). Input blocks are copied, so producers may reuse buffers.
+    """
+    pending = []
+    pending_frames = 0
+    for block in blocks:
+        pending.append(np.array(block, dtype=np.float32))
+        pending_frames += block.shape[1]
+        while pending_frames >= block_frames:
+            joined = np.concatenate(pending, axis=1) if len(pending) > 1 else pending[0]
+            yield joined[:, :block_frames]
+            rest = joined[:, block_frames:]
+            pending = [rest] if rest.shape[1] else []
+            pending_frames = rest.shape[1]
+    if pending_frames:
+        yield np.concatenate(pending, axis=1)
+
+
+def process_stream(board, blocks, samplerate: float, tail_seconds: float = 0.0):
+    """
+    Runs a Pedalboard over an iterator of (channels, frames) blocks without
+    resetting plugin state between blocks.
+
+    With reset=False Pedalboard compensates plugin latency by returning fewer
+    frames at first, so blocks come out with varying lengths. After the input
+    ends, silence is fed until the output is as long as the input plus
+    tail_seconds (e.g. a reverb tail).
+    """
+    board.reset()
+    channels = None
+    frames_in = 0
+    frames_out = 0
+    for block in blocks:
+        channels = block.shape[0]
+        frames_in += block.shape[1]
+        out = board(block, samplerate, reset=False)
+        frames_out += out.shape[1]
+        if out.shape[1]:
+            yield out
+
+    target = frames_in + int(tail_seconds * samplerate)
+    silence = np.zeros((channels or 1, BLOCK_FRAMES), dtype=np.float32)
+    # Latency is far below a block, so a few extra silent blocks always drain it
+    for _ in range(int(max(0, target - frames_out) / BLOCK_FRAMES) + 8):
+        if channels is None or frames_out >= target:
+            break
+        out = board(silence, samplerate, reset=False)[:, :target - frames_out]
+        frames_out += out.shape[1]
+        if out.shape[1]:
+            yield out
+
+
+def limit_peaks(blocks, samplerate: float, ceiling: float = 1.0,
+                lookahead_seconds: float = 0.005, hold_seconds: float = 0.05):
+    """
+    Lookahead peak limiter over a block stream: keeps every sample within
+    +-ceiling and is exactly unity gain wherever the signal already is.
+
+    The gain needed at each frame is the lowest ceiling/peak within
+    hold_seconds before and lookahead_seconds after it, ramped in and out
+    over lookahead_seconds (a trailing moving average, which never rises
+    above what any frame it covers needs). Output is delayed internally by
+    lookahead_seconds; length equals input length.
+    """
+    lookahead = max(1, int(lookahead_seconds * samplerate))
+    hold = int(hold_seconds * samplerate)
+    span = hold + lookahead + 1
+    history = np.ones(hold + lookahead, dtype=np.float32)  # needed gain before pending
+    pending = None  # input frames delayed for the lookahead
+
+    def needed_gain(audio):
+        peak = np.abs(audio).max(axis=0)
+        return np.minimum(1.0, ceiling / np.maximum(peak, 1e-20)).astype(np.float32)
+
+    def limited(audio, gain, frames):
+        if gain.min() >= 1.0:
+            return audio[:, :frames]
+        # Lowest need within [t - hold, t + lookahead], then the trailing average over lookahead + 1
+        floor = ndimage.minimum_filter1d(gain, span, origin=hold - span // 2, mode="nearest")
+        smooth = ndimage.uniform_filter1d(floor, lookahead + 1, origin=lookahead - (lookahead + 1) // 2, mode="nearest")
+        start = history.size
+        return audio[:, :frames] * np.minimum(smooth[start:start + frames], 1.0)
+
+    for block in blocks:
+        audio = block if pending is None else np.concatenate([pending, block], axis=1)
+        gain = np.concatenate([history, needed_gain(audio)])
+        frames = audio.shape[1] - lookahead
+        if frames > 0:
+            yield limited(audio, gain, frames)
+            history = gain[frames:frames + history.size]
+            pending = audio[:, frames:].copy()  # blocks may be reused buffers
+        else:
+            pending = audio.copy()
+
+    if pending is not None and pending.shape[1]:
+        gain = np.concatenate([history, needed_gain(pending), np.ones(lookahead, dtype=np.float32)])
+        yield limited(pending, gain, pending.shape[1])
+
+
+def best_splice(tail: np.ndarray, audio: np.ndarray, lo: int, hi: int) -> tuple:
+    """
+    Finds where audio continues tail most smoothly: the offset o in [lo, hi]
+    whose audio[:, o:o + n] correlates best with the n frames of tail.
+    Returns (offset, normalized correlation clipped to [0, 1]).
+    """
+    n = tail.shape[1]
+    hi = max(lo, min(hi, audio.shape[1] - n))
+    ref = tail.mean(axis=0)
+    candidates = audio[:, lo:hi + n].mean(axis=0)
+    xcorr = signal.correlate(candidates, ref, mode="valid", method="fft")
+    energy = np.convolve(candidates ** 2, np.ones(n), mode="valid")
+    rho = xcorr / np.sqrt(np.maximum(energy * np.dot(ref, ref), 1e-20))
+    best = int(np.argmax(rho))
+    return lo + best, float(np.clip(rho[best], 0.0, 1.0))
+
+
+def crossfade(tail: np.ndarray, head: np.ndarray, correlation: float) -> np.ndarray:
+    """
+    Fades from tail into head (same shape). The gains are normalized for how
+    well the two correlate: linear for identical material, equal-power for
+    unrelated material, so the level holds across the join either way.
+    """
+    n = tail.shape[1]
+    t = (np.arange(n, dtype=np.float32) + 0.5) / n
+    gain = 1.0 / np.sqrt(t * t + (1 - t) * (1 - t) + 2 * correlation * t * (1 - t))
+    return head * (t * gain) + tail * ((1 - t) * gain)
+
+
+class ChunkSplicer:
+    """
+    Joins independently rendered, overlapping chunks of one stream, as in
+    WSOLA: each chunk is spliced onto the previous one at the offset (within
+    +-search frames) where the two match best, then crossfaded over fade
+    frames. The splice offsets never drift more than search frames from the
+    input's timeline.
+    """
+
+    def __init__(self, fade: int, search: int):
+        self.fade = fade
+        self.search = search
+        self.tail = None     # processed frames still waiting to be crossfaded
+        self.drift = 0       # input frames skipped (>0) or repeated (<0) by the splices so far
+        self.frames_out = 0
+
+    def add(self, out: np.ndarray, tail_end: int = 0):
+        """
+        Takes the next rendered chunk, in which the previous chunk's output
+        nominally ends at frame tail_end, and yields the frames that are final.
+        """
+        if self.tail is not None:
+            n = self.tail.shape[1]
+            nominal = tail_end - n
+            start, correlation = best_splice(
+                self.tail, out, max(0, nominal - self.search - self.drift), nominal + self.search - self.drift
+            )
+            self.drift += start - nominal
+            out = out[:, start:]
+            out[:, :n] = crossfade(self.tail, out[:, :n], correlation)
+
+        keep = min(self.fade, out.shape[1])
+        self.tail = out[:, out.shape[1] - keep:]
+        if out.shape[1] > keep:
+            self.frames_out += out.shape[1] - keep
+            yield out[:, :out.shape[1] - keep]
+
+    def finish(self, total_frames: int):
+        """Yields the last frames, undoing the remaining drift so the output totals total_frames."""
+        if self.tail is None:
+            return
+        rest = total_frames - self.frames_out
+        if self.tail.shape[1] and rest > 0:
+            yield self.tail[:, :rest]
+        if rest > self.tail.shape[1]:
+            yield np.zeros((self.tail.shape[0], rest - self.tail.shape[1]), dtype=np.float32)
+
+
+def process_chunked(board, blocks, samplerate: float, chunk_frames: int = 4 * BLOCK_FRAMES,
+                    preroll_seconds: float = 0.5, fade_seconds: float = 0.05,
+                    search_seconds: float = 0.012):
+    """
+    Runs a Pedalboard over a block stream in independent, overlapping chunks.
+
+    For plugins that misbehave when streamed with reset=False (PitchShift drops
+    or truncates audio). Every chunk is processed with reset=True and starts
+    preroll_seconds early, so the plugin has settled by the time its output is
+    used. Two independent PitchShift renders don't line up in phase, so a plain
+    crossfade partly cancels; instead ChunkSplicer joins the chunks in phase,
+    within +-search_seconds (about one period of 40 Hz). Output length equals
+    input length.
+    """
+    preroll = int(preroll_seconds * samplerate)
+    search = int(search_seconds * samplerate)
+    splicer = ChunkSplicer(int(fade_seconds * samplerate), search)
+    carry = None  # input frames the next chunk re-processes (preroll + search + fade)
+    frames_in = 0
+    for block in rechunk(blocks, chunk_frames):
+        frames_in += block.shape[1]
+        window = block if carry is None else np.concatenate([carry, block], axis=1)
+        out = board(window, samplerate, reset=True)
+        # The previous output ends where the carried frames end
+        yield from splicer.add(out, 0 if carry is None else carry.shape[1])
+        carry = window[:, window.shape[1] - min(window.shape[1], splicer.fade + preroll + 2 * search):]
+
+    yield from splicer.finish(frames_in)
+
+
+class FFmpegEncoder:
+    """
+    Pipes float32 PCM blocks into a single ffmpeg process.
+    Nothing is buffered beyond the block being written.
+    """
+
+    def __init__(self, output_path: str, samplerate: float, channels: int, format: str = "mp3"):
+        if format not in ENCODER_ARGS:
+            raise ValueError(f"Unsupported export format: {format}")
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "f32le", "-ar", str(int(samplerate)), "-ac", str(channels), "-i", "pipe:0",
+            *ENCODER_ARGS[format],
+            output_path,
+        ]
+        self.output_path = output_path
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, block: np.ndarray):
+        # (channels, frames) -> interleaved frames
+        self.process.stdin.write(np.ascontiguousarray(block.T, dtype=np.float32).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='ignore').strip()}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.process.kill()
+            self.process.wait()
+        return False
@@ -0,0 +1,69 @@
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from services.atomic_json import write_json
+
+# youtu.be/<id>, /shorts/<id>, /embed/<id>, /live/<id>
+_PATH_ID = re.compile(r"^/(?:shorts/|embed/|live/|v/)?([A-Za-z0-9_-]{11})(?:/|$)")
+
+
+def video_key(url: str) -> str:
+    """
+    Stable key for a video URL, worked out without touching the network:
+    "youtube:<id>" for YouTube links (whatever the form), else the URL itself.
+    """
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    if host.endswith("youtube.com") or host.endswith("youtu.be") or host.endswith("youtube-nocookie.com"):
+        video_id = parse_qs(parsed.query).get("v", [None])[0]
+        if not video_id:
+            match = _PATH_ID.match(parsed.path)
+            video_id = match.group(1) if match else None
+        if video_id:
+            return f"youtube:{video_id}"
+    return url.strip()
+
+
+class DownloadIndex:
+    """
+    Maps a video (see video_key) to the audio file and subtitles already
+    downloaded for it, in temp_audio/downloads_index.json. A repeat request
+    for the same video is served from disk without calling yt-dlp.
+    """
+
+    def __init__(self, root="temp_audio"):
+        self.path = os.path.join(root, "downloads_index.json")
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                print(f"Error loading download index: {e}")
+
+    def _save(self):
+        write_json(self.path, self.entries)
+
+    def lookup(self, url: str):
+        """Returns {path, title, track_name, subtitles} if the audio file is still on disk."""
+        with self._lock:
+            entry = self.entries.get(video_key(url))
+        if entry and os.path.exists(entry["path"]):
+            return entry
+        return None
+
+    def record(self, url: str, path: str, title: str, track_name: str, subtitles: dict):
+        with self._lock:
+            self.entries[video_key(url)] = {
+                "path": path,
+                "title": title,
+                "track_name": track_name,
+                "subtitles": subtitles,
+                "downloaded_at": time.time(),
+            }
+            self._save()
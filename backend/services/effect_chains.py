@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ChainRegistry:
+    """
+    Reuses configured Pedalboard chains instead of building one per request.
+
+    Chains are keyed by their parameters (a hashable tuple). A chain holds
+    plugin state while it runs, so it is checked out exclusively: concurrent
+    requests with the same parameters get separate instances, and each one
+    goes back to the idle pool (reset) when its request is done.
+    """
+
+    def __init__(self, max_keys=32, max_idle_per_key=4):
+        self.max_keys = max_keys
+        self.max_idle_per_key = max_idle_per_key
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self.built = 0
+        self.reused = 0
+
+    @contextmanager
+    def checkout(self, key, factory):
+        """Yields an idle chain for key, or factory() if none is free."""
+        with self._lock:
+            pool = self._idle.get(key)
+            board = pool.pop() if pool else None
+            if board is not None:
+                self._idle.move_to_end(key)
+                self.reused += 1
+            else:
+                self.built += 1
+        if board is None:
+            board = factory()
+        try:
+            yield board
+        finally:
+            board.reset()
+            with self._lock:
+                pool = self._idle.setdefault(key, [])
+                self._idle.move_to_end(key)
+                if len(pool) < self.max_idle_per_key:
+                    pool.append(board)
+                # Forget the least recently used parameter sets
+                while len(self._idle) > self.max_keys:
+                    self._idle.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._idle),
+                "idle": sum(len(pool) for pool in self._idle.values()),
+                "built": self.built,
+                "reused": self.reused,
+            }
@@ -1,8 +1,12 @@
 import os
-import librosa
-import soundfile as sf
+import time
+import uuid
 import numpy as np
-from pydub import AudioSegment
+from pedalboard import Pedalboard, PitchShift
+from services.audio_stream import (
+    BLOCK_FRAMES, FFmpegEncoder, limit_peaks, match_channels, offset_blocks, open_audio, process_chunked,
+    read_blocks, rechunk
+)
 
 class ExportService:
     def __init__(self):
@@ -10,84 +14,100 @@ class ExportService:
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-    def mix_and_export(self, stems, volumes, pitch_shift, format="mp3"):
+    def _mix_blocks(self, sources, channels):
+        """
+        Sums (blocks, volume) sources into one preallocated buffer, block by block.
+        Each yielded block is only valid until the next one is requested.
+        """
+        mix = np.zeros((channels, BLOCK_FRAMES), dtype=np.float32)
+        sources = [(rechunk(blocks, BLOCK_FRAMES), vol) for blocks, vol in sources]
+        while sources:
+            mix[:] = 0
+            frames = 0
+            alive = []
+            for blocks, vol in sources:
+                block = next(blocks, None)
+                if block is None:
+                    continue
+                alive.append((blocks, vol))
+                mix[:, :block.shape[1]] += vol * match_channels(block, channels)
+                frames = max(frames, block.shape[1])
+            sources = alive
+            if frames:
+                yield mix[:, :frames]
+
+    def mix_and_export(self, stems, volumes, pitch_shift, format="mp3", pitch_mode="bus", offsets=None):
         """
         Mixes stems with volume and pitch adjustments.
         stems: dict of {stem_name: file_path}
         volumes: dict of {stem_name: volume_float (0.0-1.0)}
         pitch_shift: float (semitones)
         format: "mp3" or "mp4" (audio only)
+        pitch_mode: "bus" sums the stems first and shifts the mix once;
+                    "stems" shifts every stem separately (4x the CPU)
+        offsets: dict of {stem_name: seconds} to start a track later (or earlier, if negative),
+                 e.g. an aligned recording
+
+        Stems are read, mixed and encoded block by block, so memory stays flat
+        regardless of song length and the stereo image is kept.
         """
+        if pitch_mode not in ("bus", "stems"):
+            raise ValueError(f"Unknown pitch mode: {pitch_mode}")
+
+        offsets = offsets or {}
+        readers = []
         try:
-            print(f"Exporting with volumes={volumes}, pitch={pitch_shift}")
-            
-            mixed_audio = None
-            sr = 44100 # Standard sample rate
+            print(f"Exporting with volumes={volumes}, pitch={pitch_shift} ({pitch_mode})")
 
+            sr = None
+            sources = []
             for stem_name, file_path in stems.items():
                 if not os.path.exists(file_path):
                     continue
-                
+
                 vol = volumes.get(stem_name, 1.0)
                 if vol == 0:
                     continue # Skip silent tracks
 
-                # Load audio
-                y, _ = librosa.load(file_path, sr=sr)
-
-                # Apply Pitch Shift (if needed)
-                # Note: Pitch shifting is expensive. 
-                if pitch_shift != 0:
-                    # Use librosa for high quality time-stretching pitch shift
-                    y = librosa.effects.pitch_shift(y, sr=sr, n_steps=pitch_shift)
-
-                # Apply Volume
-                y = y * vol
-
-                # Mix
-                if mixed_audio is None:
-                    mixed_audio = y
-                else:
-                    # Ensure lengths match
-                    if len(y) > len(mixed_audio):
-                        mixed_audio = np.pad(mixed_audio, (0, len(y) - len(mixed_audio)))
-                    elif len(y) < len(mixed_audio):
-                        y = np.pad(y, (0, len(mixed_audio) - len(y)))
-                    
-                    mixed_audio = mixed_audio + y
-
-            if mixed_audio is None:
+                # First stem sets the rate; others are resampled on the fly if needed
+                reader = open_audio(file_path, sr)
+                sr = sr or reader.samplerate
+                readers.append(reader)
+
+                blocks = read_blocks(reader)
+                offset = offsets.get(stem_name, 0.0)
+                if offset:
+                    blocks = offset_blocks(blocks, int(round(offset * sr)), reader.num_channels)
+                # Pitch shifting is expensive; in stems mode each stem gets its own shifter
+                if pitch_shift != 0 and pitch_mode == "stems":
+                    blocks = process_chunked(Pedalboard([PitchShift(semitones=pitch_shift)]), blocks, sr)
+                sources.append((blocks, vol))
+
+            if not sources:
                 return None
 
-            # Normalize to prevent clipping
-            max_val = np.max(np.abs(mixed_audio))
-            if max_val > 1.0:
-                mixed_audio = mixed_audio / max_val
+            channels = max(reader.num_channels for reader in readers)
 
-            # Save to temporary WAV first
-            temp_wav = os.path.join(self.output_dir, "temp_mix.wav")
-            sf.write(temp_wav, mixed_audio, sr)
+            # Bus: one shift for a uniform transpose, then keep peaks under
+            # 0 dBFS without a second pass over the whole mix; a mix that
+            # never clips passes through untouched
+            blocks = self._mix_blocks(sources, channels)
+            if pitch_shift != 0 and pitch_mode == "bus":
+                blocks = process_chunked(Pedalboard([PitchShift(semitones=pitch_shift)]), blocks, sr)
+            blocks = limit_peaks(blocks, sr)
 
-            # Convert to requested format using pydub (which uses ffmpeg)
-            output_filename = f"mix_{int(os.path.getmtime(temp_wav))}.{format}"
+            output_filename = f"mix_{int(time.time())}_{uuid.uuid4().hex[:6]}.{format}"
             output_path = os.path.join(self.output_dir, output_filename)
-            
-            audio = AudioSegment.from_wav(temp_wav)
-            audio.export(output_path, format="mp3" if format == "mp4" else format) # MP4 audio is usually AAC/MP3 container, but user asked for mp4 file. ffmpeg can wrap mp3 in mp4 or just save as mp3.
-            # If format is mp4, we should probably output an audio-only mp4 (m4a) or just mp3.
-            # User asked for "mp3 or mp4".
-            if format == "mp4":
-                 # Export as mp4 (audio only)
-                 audio.export(output_path, format="mp4")
-            else:
-                 audio.export(output_path, format="mp3")
-
-            # Cleanup temp
-            if os.path.exists(temp_wav):
-                os.remove(temp_wav)
+
+            with FFmpegEncoder(output_path, sr, channels, format) as encoder:
+                for block in blocks:
+                    encoder.write(block)
 
             return output_path
 
         except Exception as e:
             print(f"Error exporting: {e}")
             return None
+        finally:
+            for reader in readers:
+                reader.close()
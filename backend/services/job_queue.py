@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from services.atomic_json import write_json
+
+# Lifecycle of a /process job
+JOB_STATES = ["queued", "downloading", "key", "separating", "done", "failed"]
+TERMINAL_STATES = {"done", "failed"}
+
+
+class JobQueue:
+    """
+    Runs long audio jobs on a bounded thread pool so request handlers return
+    immediately. Each job is mirrored to temp_audio/jobs/<id>.json, so
+    finished results survive a restart. Finished jobs are kept for
+    JOB_RETENTION_HOURS (default 72) and at most JOB_MAX_KEPT (default 500)
+    of them; older ones are dropped along with their files.
+    """
+
+    def __init__(self, root="temp_audio", max_workers=None, max_age=None, max_kept=None):
+        self.jobs_dir = os.path.join(root, "jobs")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        if max_workers is None:
+            max_workers = int(os.environ.get("VOCALIZE_MAX_JOBS", 2))
+        if max_age is None:
+            max_age = float(os.environ.get("JOB_RETENTION_HOURS", 72)) * 3600
+        if max_kept is None:
+            max_kept = int(os.environ.get("JOB_MAX_KEPT", 500))
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.max_kept = max_kept
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+        self._lock = threading.Lock()
+        self.jobs = {}
+        self._load_jobs()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _load_jobs(self):
+        """Restores jobs from disk. Jobs that were still running are marked failed."""
+        for filename in os.listdir(self.jobs_dir):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.jobs_dir, filename), "r") as f:
+                    job = json.load(f)
+            except Exception as e:
+                print(f"Error loading job {filename}: {e}")
+                continue
+
+            if job.get("state") not in TERMINAL_STATES:
+                job["state"] = "failed"
+                job["error"] = "Interrupted by server restart"
+                job["updated_at"] = datetime.now().isoformat()
+                self._save(job)
+            self.jobs[job["id"]] = job
+        self._prune()
+
+    def _prune(self):
+        """Drops finished jobs past the retention age, then the oldest beyond max_kept."""
+        cutoff = datetime.now().timestamp() - self.max_age
+        finished = sorted(
+            (job for job in self.jobs.values() if job.get("state") in TERMINAL_STATES),
+            key=lambda job: job["updated_at"],
+        )
+        excess = len(finished) - self.max_kept
+        for i, job in enumerate(finished):
+            if i >= excess and datetime.fromisoformat(job["updated_at"]).timestamp() >= cutoff:
+                continue
+            del self.jobs[job["id"]]
+            try:
+                os.remove(self._job_path(job["id"]))
+            except FileNotFoundError:
+                pass
+
+    def _save(self, job):
+        # Write then rename so a crash never leaves a half-written job file
+        path = self._job_path(job["id"])
+        write_json(path, job)
+
+    def submit(self, fn, payload=None) -> dict:
+        """
+        Queues fn(set_state) on the pool and returns the new job.
+        fn reports progress through set_state(state) and returns the job result.
+        """
+        now = datetime.now().isoformat()
+        job = {
+            "id": uuid.uuid4().hex,
+            "state": "queued",
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._prune()
+            self.jobs[job["id"]] = job
+            self._save(job)
+
+        self.executor.submit(self._run, job["id"], fn)
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self.jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = datetime.now().isoformat()
+            self._save(job)
+            return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job_id, fn):
+        def set_state(state):
+            if state not in JOB_STATES:
+                raise ValueError(f"Unknown job state: {state}")
+            print(f"Job {job_id}: {state}")
+            self.update(job_id, state=state)
+
+        try:
+            result = fn(set_state)
+            self.update(job_id, state="done", result=result)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            traceback.print_exc()
+            self.update(job_id, state="failed", error=str(e))
@@ -0,0 +1,33 @@
+import threading
+from contextlib import contextmanager
+
+
+class KeyedLocks:
+    """
+    One lock per key (e.g. a content hash), so work on the same item is
+    serialized while different items run in parallel. A key's lock exists
+    only while someone holds or waits on it, so the table doesn't grow with
+    every key ever seen.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._guard:
+            return len(self._locks)
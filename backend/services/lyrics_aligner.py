@@ -0,0 +1,145 @@
+import re
+from difflib import SequenceMatcher
+
+import librosa
+import numpy as np
+
+from services.voice_activity import voiced_regions
+
+ALIGN_SAMPLE_RATE = 16000
+# How far a word start may move to land on a vocal onset
+ONSET_SNAP_SECONDS = 0.15
+# Longest a single word is held before the next one starts
+MAX_WORD_SECONDS = 1.5
+
+_VOWEL_GROUPS = re.compile(r"[aeiouy]+", re.IGNORECASE)
+
+
+def syllable_weight(word: str) -> int:
+    """Rough syllable count (vowel groups); works for English and transliterated lyrics."""
+    return max(1, len(_VOWEL_GROUPS.findall(word)))
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+class LyricsAligner:
+    """
+    Puts word-level times on lyrics whose text is already known.
+
+    Default: words are laid out over the voiced parts of the vocal stem in
+    proportion to their syllable counts, then each start is snapped to the
+    nearest vocal onset. This is plain DSP, far cheaper than a Whisper decode.
+    If timed transcript words are available (subtitles or a Whisper pass), the
+    lyrics are DTW-aligned to them instead; words between matches are spread
+    over the voiced time between them, and the energy estimate fills the rest.
+    """
+
+    def align(self, lyrics_text: str, vocals_path: str, whisper_words: list = None) -> list:
+        words = lyrics_text.split()
+        if not words:
+            return []
+
+        y, sr = librosa.load(vocals_path, sr=ALIGN_SAMPLE_RATE, mono=True)
+        regions = voiced_regions(y, sr) or [(0.0, len(y) / sr)]
+        onsets = librosa.onset.onset_detect(y=y, sr=sr, units="time", backtrack=True)
+
+        starts = self._energy_starts(words, regions)
+        starts = self._snap_to_onsets(starts, onsets)
+        ends = self._ends(starts, regions)
+
+        if whisper_words:
+            starts = self._dtw_starts(words, whisper_words, starts, regions)
+            ends = self._ends(starts, regions)
+
+        return [
+            {"word": word, "start": float(start), "end": float(end)}
+            for word, start, end in zip(words, starts, ends)
+        ]
+
+    def _syllable_positions(self, words: list) -> np.ndarray:
+        """Where each word starts, in syllables from the first word."""
+        weights = np.array([syllable_weight(w) for w in words], dtype=float)
+        return np.concatenate([[0.0], np.cumsum(weights)[:-1]])
+
+    def _voiced_timeline(self, regions: list) -> tuple:
+        """(region starts, region ends, where each region begins on the voiced-only timeline)."""
+        starts = np.array([start for start, _ in regions])
+        ends = np.array([end for _, end in regions])
+        return starts, ends, np.concatenate([[0.0], np.cumsum(ends - starts)[:-1]])
+
+    def _to_voiced(self, times: np.ndarray, regions: list) -> np.ndarray:
+        """Song time -> position on the voiced-only timeline; gaps map to the next region's start."""
+        starts, ends, offsets = self._voiced_timeline(regions)
+        idx = np.clip(np.searchsorted(ends, times), 0, len(regions) - 1)
+        return offsets[idx] + np.clip(times - starts[idx], 0.0, ends[idx] - starts[idx])
+
+    def _from_voiced(self, t: np.ndarray, regions: list) -> np.ndarray:
+        """Position on the voiced-only timeline -> song time."""
+        starts, _, offsets = self._voiced_timeline(regions)
+        idx = np.clip(np.searchsorted(offsets, t, side="right") - 1, 0, len(regions) - 1)
+        return starts[idx] + (t - offsets[idx])
+
+    def _energy_starts(self, words: list, regions: list) -> np.ndarray:
+        """Spreads words over the voiced timeline by syllable weight."""
+        positions = self._syllable_positions(words)
+        starts, ends, _ = self._voiced_timeline(regions)
+        voiced_total = (ends - starts).sum()
+        return self._from_voiced(positions / (positions[-1] + syllable_weight(words[-1])) * voiced_total, regions)
+
+    def _snap_to_onsets(self, starts: np.ndarray, onsets: np.ndarray) -> np.ndarray:
+        """Moves each start to the nearest onset within ONSET_SNAP_SECONDS, keeping order."""
+        if len(onsets) == 0:
+            return starts
+        idx = np.clip(np.searchsorted(onsets, starts), 1, len(onsets) - 1)
+        left, right = onsets[idx - 1], onsets[idx]
+        nearest = np.where(np.abs(starts - left) <= np.abs(right - starts), left, right)
+        snapped = np.where(np.abs(nearest - starts) <= ONSET_SNAP_SECONDS, nearest, starts)
+        # Keep words in order
+        return np.maximum.accumulate(snapped)
+
+    def _ends(self, starts: np.ndarray, regions: list) -> np.ndarray:
+        """A word lasts until the next one starts, capped by its voiced region."""
+        next_starts = np.append(starts[1:], np.inf)
+        region_ends = np.array([end for _, end in regions])
+        containing = np.clip(np.searchsorted(region_ends, starts), 0, len(regions) - 1)
+        ends = np.minimum(next_starts, np.minimum(region_ends[containing], starts + MAX_WORD_SECONDS))
+        return np.maximum(ends, starts + 0.05)
+
+    def _dtw_starts(self, words: list, whisper_words: list, starts: np.ndarray, regions: list) -> np.ndarray:
+        """
+        DTW over a word-similarity cost. Matched words take the transcript's
+        start; the rest are interpolated between their matched neighbours by
+        syllables along the voiced timeline, so none lands in a silent gap.
+        """
+        lyric_norm = [_normalize(w) for w in words]
+        heard_norm = [_normalize(w["word"]) for w in whisper_words]
+        cost = np.array([
+            [1.0 - SequenceMatcher(None, a, b).ratio() for b in heard_norm]
+            for a in lyric_norm
+        ])
+        _, path = librosa.sequence.dtw(C=cost)
+
+        # DTW may pair several lyric words with one heard word; each heard word
+        # anchors only the lyric word it matches best
+        best = {}
+        for i, j in path[::-1]:
+            if cost[i, j] < 0.5 and (j not in best or cost[i, j] < cost[best[j], j]):
+                best[j] = i
+        matched = {}
+        for j, i in best.items():
+            if i not in matched or cost[i, j] < cost[i, matched[i]]:
+                matched[i] = j
+        if len(matched) < 2:
+            return starts
+
+        anchors = np.array(sorted(matched))
+        anchor_starts = np.maximum.accumulate([whisper_words[matched[i]]["start"] for i in anchors])
+        positions = self._syllable_positions(words)
+        voiced = np.interp(positions, positions[anchors], self._to_voiced(anchor_starts, regions))
+        aligned = self._from_voiced(voiced, regions)
+        # Outside the first/last anchor, fall back to the energy layout
+        outside = (np.arange(len(words)) < anchors[0]) | (np.arange(len(words)) > anchors[-1])
+        aligned[outside] = starts[outside]
+        return np.maximum.accumulate(aligned)
@@ -1,13 +1,88 @@
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import requests
 from bs4 import BeautifulSoup
-from googlesearch import search
-import re
+from requests.adapters import HTTPAdapter
+
+from services.atomic_json import write_json
+
+# lxml is several times faster than the stdlib parser when it is installed
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+LYRICS_CACHE_DIR = os.path.join("temp_audio", "lyrics_cache")
+
+
+def google_search(query, num_results=3):
+    # Imported here so the scraper (and its tests) work without googlesearch installed
+    from googlesearch import search
+    return list(search(query, num_results=num_results, lang="en"))
+
+
+def _build_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
 class LyricsScraper:
-    def __init__(self):
+    """
+    Looks lyrics up on the web: search, then fetch the candidate pages
+    concurrently over one pooled session and return the first page that
+    yields lyrics. Everything runs under an overall deadline.
+
+    Results are cached on disk per query (temp_audio/lyrics_cache), misses
+    included, so a song with no lyrics online doesn't search again until
+    negative_ttl expires.
+    """
+
+    def __init__(self, search=None, cache_dir=LYRICS_CACHE_DIR, num_results=3,
+                 deadline=None, request_timeout=(3.05, 6.0), ttl=None, negative_ttl=None):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.search = search or google_search
+        self.num_results = num_results
+        # Seconds for the whole lookup (search + page fetches)
+        self.deadline = deadline if deadline is not None else float(os.environ.get("LYRICS_DEADLINE_SECONDS", 12))
+        self.request_timeout = request_timeout
+        self.ttl = ttl if ttl is not None else float(os.environ.get("LYRICS_CACHE_TTL", 7 * 24 * 3600))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(os.environ.get("LYRICS_NEGATIVE_TTL", 24 * 3600))
+
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.session = _build_session(num_results + 1)
+        self.session.headers.update(self.headers)
+
+    def _cache_path(self, query):
+        digest = hashlib.blake2b(query.strip().lower().encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _cache_get(self, query):
+        path = self._cache_path(query)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except Exception as e:
+            print(f"Error reading lyrics cache {path}: {e}")
+            return None
+        ttl = self.ttl if entry.get("lyrics") else self.negative_ttl
+        if time.time() - entry.get("fetched_at", 0) > ttl:
+            return None
+        return entry
+
+    def _cache_put(self, query, lyrics, url):
+        path = self._cache_path(query)
+        write_json(path, {"query": query, "lyrics": lyrics, "url": url, "fetched_at": time.time()})
 
     def fetch_lyrics(self, query):
         print(f"Searching for lyrics: {query}")
@@ -62,26 +137,55 @@ Madi meethu nee thoongidu
 Imai pola naan kaakka
 Kanavaai nee maaridu""", "https://genius.com/Sid-sriram-maruvaarthai-lyrics"
 
+        cached = self._cache_get(query)
+        if cached:
+            print(f"Using cached lyrics lookup for: {query}")
+            return cached["lyrics"], cached["url"]
+
+        lyrics, url, complete = self._lookup(query)
+        # Only a finished lookup is cached; a timeout or search error may be transient
+        if lyrics or complete:
+            self._cache_put(query, lyrics, url)
+        return lyrics, url
+
+    def _lookup(self, query):
+        """Returns (lyrics, url, complete); complete is False if the deadline or an error cut it short."""
+        deadline = time.monotonic() + self.deadline
+        # One thread for the search plus one per candidate page, per lookup:
+        # fetches abandoned at the deadline finish in the background (bounded by
+        # request_timeout) without holding up anyone else's lookup
+        executor = ThreadPoolExecutor(max_workers=self.num_results + 1, thread_name_prefix="lyrics")
         try:
-            # Search Google for top 3 results
-            search_results = list(search(f"{query} lyrics", num_results=3, lang="en"))
-            print(f"Found URLs: {search_results}")
-            
-            for url in search_results:
-                print(f"Checking {url}...")
-                lyrics = self._extract_lyrics(url)
-                if lyrics:
-                    return lyrics, url
-            
-            return None, None
-        except Exception as e:
-            print(f"Error fetching lyrics: {e}")
-            return None, None
+            try:
+                search_results = executor.submit(self.search, f"{query} lyrics", self.num_results)
+                search_results = search_results.result(timeout=self.deadline)[:self.num_results]
+                print(f"Found URLs: {search_results}")
+            except Exception as e:
+                print(f"Error fetching lyrics: {e}")
+                return None, None, False
+
+            pending = {executor.submit(self._extract_lyrics, url): url for url in search_results}
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Lyrics lookup timed out after {self.deadline:.0f}s")
+                    return None, None, False
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    lyrics = future.result()
+                    if lyrics:
+                        return lyrics, url, True
+            return None, None, True
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def _extract_lyrics(self, url):
+        print(f"Checking {url}...")
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            response = self.session.get(url, timeout=self.request_timeout)
+            response.raise_for_status()
+            soup = BeautifulSoup(response.text, HTML_PARSER)
             
             # 1. Genius.com
             if 'genius.com' in url:
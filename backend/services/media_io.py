@@ -0,0 +1,122 @@
+import os
+import re
+import uuid
+
+import requests
+
+# Bodies are copied in 1 MiB chunks, so memory use doesn't grow with file size
+CHUNK_BYTES = 1 << 20
+# Largest download/upload accepted (MAX_MEDIA_MB, default 200)
+MAX_MEDIA_BYTES = int(float(os.environ.get("MAX_MEDIA_MB", 200)) * (1 << 20))
+
+_CONTENT_TYPES = {
+    "audio/wav": ".wav", "audio/x-wav": ".wav", "audio/wave": ".wav",
+    "audio/mpeg": ".mp3", "audio/mp3": ".mp3",
+    "audio/flac": ".flac", "audio/x-flac": ".flac",
+    "audio/ogg": ".ogg", "audio/opus": ".ogg",
+    "audio/webm": ".webm", "video/webm": ".webm",
+    "audio/mp4": ".m4a", "audio/x-m4a": ".m4a", "audio/aac": ".aac", "video/mp4": ".mp4",
+}
+
+
+# "<prefix>_<12 hex>" as save_chunks names files, optionally with the stem
+# cache's "_<8 hex>" suffix
+_GENERATED_NAME = re.compile(r"^[A-Za-z]+(?:_[A-Za-z]+)*_[0-9a-f]{12}(?:_[0-9a-f]{8})?$")
+
+
+class MediaTooLarge(ValueError):
+    pass
+
+
+class UnsupportedMedia(ValueError):
+    pass
+
+
+def sniff_audio_extension(head: bytes, content_type: str = None) -> str:
+    """
+    File extension for an audio body, from its first bytes (magic numbers),
+    falling back to the declared content type. Raises UnsupportedMedia if
+    it doesn't look like audio.
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return ".wav"
+    if head[:4] == b"fLaC":
+        return ".flac"
+    if head[:4] == b"OggS":
+        return ".ogg"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return ".webm"
+    if head[4:8] == b"ftyp":
+        return ".m4a"
+    if head[:4] == b"FORM" and head[8:12] in (b"AIFF", b"AIFC"):
+        return ".aiff"
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return ".mp3"
+
+    declared = (content_type or "").split(";")[0].strip().lower()
+    if declared in _CONTENT_TYPES:
+        return _CONTENT_TYPES[declared]
+    raise UnsupportedMedia(f"Not a recognized audio file (content type: {content_type or 'unknown'})")
+
+
+def is_generated_name(name: str) -> bool:
+    """True for a name save_chunks made up (e.g. upload_1a2b3c4d5e6f), which says nothing about the song."""
+    return bool(_GENERATED_NAME.match(name or ""))
+
+
+def save_chunks(chunks, directory: str, prefix: str, content_type: str = None,
+                max_bytes: int = MAX_MEDIA_BYTES) -> str:
+    """
+    Writes an iterable of byte chunks to a new, uniquely named file in directory.
+    The extension comes from sniffing the first bytes. Stops and deletes the
+    partial file if the body goes over max_bytes. Returns the file path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"{prefix}_{uuid.uuid4().hex[:12]}"
+    part_path = os.path.join(directory, name + ".part")
+    head = b""
+    written = 0
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if written > max_bytes:
+                    raise MediaTooLarge(f"File is larger than {max_bytes // (1 << 20)} MB")
+                if len(head) < 16:
+                    head += chunk[:16]
+                f.write(chunk)
+        if written == 0:
+            raise UnsupportedMedia("Empty file")
+        final_path = os.path.join(directory, name + sniff_audio_extension(head, content_type))
+        os.replace(part_path, final_path)
+        return final_path
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def download_to_file(url: str, directory: str, prefix: str = "download",
+                     max_bytes: int = MAX_MEDIA_BYTES, timeout=(5, 30)) -> str:
+    """Streams an audio URL to a unique file in directory; see save_chunks."""
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        # Refuse early when the server says up front that it's too big
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise MediaTooLarge(f"File is larger than {max_bytes // (1 << 20)} MB")
+        return save_chunks(
+            response.iter_content(chunk_size=CHUNK_BYTES), directory, prefix,
+            content_type=response.headers.get("Content-Type"), max_bytes=max_bytes,
+        )
+
+
+def save_upload(fileobj, directory: str, prefix: str = "upload", content_type: str = None,
+                max_bytes: int = MAX_MEDIA_BYTES) -> str:
+    """Copies an uploaded file object to a unique file in directory; see save_chunks."""
+    return save_chunks(
+        iter(lambda: fileobj.read(CHUNK_BYTES), b""), directory, prefix,
+        content_type=content_type, max_bytes=max_bytes,
+    )
@@ -0,0 +1,259 @@
+import os
+import threading
+
+import librosa
+import numpy as np
+from pedalboard import Pedalboard, PitchShift
+from pedalboard.io import AudioFile
+from scipy import ndimage, signal
+
+from services.audio_stream import ChunkSplicer, open_audio
+from services.key_detector import KEY_NAMES
+from services.keyed_locks import KeyedLocks
+from services.stem_cache import fingerprint_audio_file
+
+# F0 tracking runs on 16 kHz mono with 10 ms frames
+ANALYSIS_SR = 16000
+ANALYSIS_HOP = 160
+ANALYSIS_FRAME = 1024
+FMIN, FMAX = 70.0, 1000.0
+# Frames this far below the loudest one are treated as unvoiced
+VOICING_GATE_DB = -40.0
+# Bump when the analysis changes so cached F0 tracks are recomputed
+F0_VERSION = 1
+
+# Corrections are rendered in steps of this many semitones (10 cents)
+CORRECTION_STEP = 0.1
+# Shortest stretch rendered with one shift, and longest (bounds memory)
+MIN_SEGMENT_SECONDS = 0.08
+MAX_SEGMENT_SECONDS = 5.0
+# Crossfade between neighbouring segments, how far a splice may move to line
+# the segments up in phase, and context the shifter warms up on
+FADE_SECONDS = 0.02
+SEARCH_SECONDS = 0.012
+PREROLL_SECONDS = 0.2
+
+SCALE_STEPS = {
+    "major": [0, 2, 4, 5, 7, 9, 11],
+    "minor": [0, 2, 3, 5, 7, 8, 10],
+}
+
+
+def scale_pitch_classes(key: str) -> np.ndarray:
+    """
+    Pitch classes (0 = C) of a key as detect_key names it, e.g. "A Minor".
+    Anything unrecognized falls back to the chromatic scale.
+    """
+    parts = (key or "").split()
+    if len(parts) == 2 and parts[0] in KEY_NAMES and parts[1].lower() in SCALE_STEPS:
+        tonic = KEY_NAMES.index(parts[0])
+        return np.array(sorted((tonic + step) % 12 for step in SCALE_STEPS[parts[1].lower()]), dtype=float)
+    return np.arange(12, dtype=float)
+
+
+def track_f0(y: np.ndarray, sr: int) -> tuple:
+    """
+    Frame-wise F0 (Hz) and a voiced mask for a mono signal, at ANALYSIS_HOP
+    frames of ANALYSIS_SR. YIN runs over all frames at once; frames that are
+    quiet, out of range or jumping away from their neighbours are unvoiced.
+    """
+    if sr != ANALYSIS_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=ANALYSIS_SR)
+    if y.size < ANALYSIS_FRAME:
+        return np.zeros(0), np.zeros(0, dtype=bool)
+    f0 = librosa.yin(y, fmin=FMIN, fmax=FMAX, sr=ANALYSIS_SR,
+                     frame_length=ANALYSIS_FRAME, hop_length=ANALYSIS_HOP)
+    rms = librosa.feature.rms(y=y, frame_length=ANALYSIS_FRAME, hop_length=ANALYSIS_HOP)[0][:f0.size]
+    loud = librosa.amplitude_to_db(rms, ref=np.max(rms) if rms.size and np.max(rms) > 0 else 1.0) > VOICING_GATE_DB
+
+    in_range = (f0 > FMIN * 1.05) & (f0 < FMAX * 0.95)
+    midi = librosa.hz_to_midi(np.clip(f0, FMIN, FMAX))
+    stable = np.abs(midi - ndimage.median_filter(midi, size=5, mode="nearest")) < 1.0
+    return f0, loud & in_range & stable
+
+
+def correction_curve(f0: np.ndarray, voiced: np.ndarray, scale: np.ndarray, strength: float = 1.0,
+                     retune_frames: float = 6.0) -> np.ndarray:
+    """
+    Semitones to shift each frame so it lands on the nearest scale note,
+    times strength (0-1). Unvoiced frames get no correction. The curve is
+    median-filtered and then low-passed forwards and backwards (no lag);
+    retune_frames sets how quickly it follows the notes.
+    """
+    if f0.size == 0:
+        return np.zeros(0)
+    midi = librosa.hz_to_midi(np.clip(f0, FMIN, FMAX))
+    # Signed distance from every scale pitch class, wrapped into [-6, 6)
+    distance = (midi[None, :] - scale[:, None] + 6.0) % 12.0 - 6.0
+    nearest = distance[np.argmin(np.abs(distance), axis=0), np.arange(midi.size)]
+    correction = np.where(voiced, -nearest * strength, 0.0)
+
+    correction = ndimage.median_filter(correction, size=5, mode="nearest")
+    alpha = 1.0 - np.exp(-1.0 / max(retune_frames, 1e-3))
+    b, a = [alpha], [1.0, alpha - 1.0]
+    if correction.size > 3 * max(len(a), len(b)):
+        correction = signal.filtfilt(b, a, correction)
+    return correction
+
+
+def correction_segments(curve: np.ndarray, frame_seconds: float, samplerate: float, total_frames: int,
+                        default_shift: float = 0.0) -> list:
+    """
+    Quantizes a per-frame correction curve into [(start_sample, end_sample, semitones)]
+    runs of constant shift, at least MIN_SEGMENT_SECONDS and at most
+    MAX_SEGMENT_SECONDS long, covering the whole file. A file too short to
+    have a curve is shifted by default_shift throughout.
+    """
+    if curve.size == 0 or total_frames == 0:
+        return [(0, total_frames, default_shift)] if total_frames else []
+    steps = np.round(curve / CORRECTION_STEP).astype(int)
+    # Run-length encode
+    edges = np.flatnonzero(np.diff(steps)) + 1
+    starts = np.concatenate([[0], edges])
+    ends = np.concatenate([edges, [steps.size]])
+    runs = [[s, e, steps[s]] for s, e in zip(starts, ends)]
+
+    # Fold runs that are too short into the neighbour closest in shift
+    min_frames = max(1, int(round(MIN_SEGMENT_SECONDS / frame_seconds)))
+    merged = []
+    for run in runs:
+        if merged and (run[1] - run[0] < min_frames or merged[-1][1] - merged[-1][0] < min_frames):
+            prev = merged[-1]
+            if prev[1] - prev[0] < run[1] - run[0]:
+                prev[2] = run[2]
+            prev[1] = run[1]
+        else:
+            merged.append(run)
+    # Coalesce neighbours that ended up with the same shift
+    runs = []
+    for run in merged:
+        if runs and runs[-1][2] == run[2]:
+            runs[-1][1] = run[1]
+        else:
+            runs.append(run)
+
+    samples_per_frame = frame_seconds * samplerate
+    max_samples = int(MAX_SEGMENT_SECONDS * samplerate)
+    segments = []
+    for i, (s, e, step) in enumerate(runs):
+        start = 0 if i == 0 else int(round(s * samples_per_frame))
+        end = total_frames if i == len(runs) - 1 else min(total_frames, int(round(e * samples_per_frame)))
+        # Long runs are split into equal parts, so no piece is shorter than a crossfade
+        parts = max(1, -(-(end - start) // max_samples))
+        bounds = np.linspace(start, end, parts + 1).round().astype(int)
+        for part_start, part_end in zip(bounds[:-1], bounds[1:]):
+            if part_end > part_start:
+                segments.append((int(part_start), int(part_end), step * CORRECTION_STEP))
+    return segments
+
+
+class PitchCorrector:
+    """
+    Key-aware pitch correction: the take's F0 is tracked once (cached by
+    content hash under temp_audio/f0), snapped to the key's scale and
+    smoothed into a correction curve, then the take is resynthesized segment
+    by segment with a PitchShift set to each segment's correction.
+    Re-tuning with another strength or key only redoes the cheap part.
+    """
+
+    def __init__(self, chains, root="temp_audio"):
+        self.chains = chains
+        self.dir = os.path.join(root, "f0")
+        os.makedirs(self.dir, exist_ok=True)
+        self._memo = {}
+        self._lock = threading.Lock()
+        # One analysis per take at a time
+        self._analysis_locks = KeyedLocks()
+
+    def analyze(self, input_path: str) -> dict:
+        """Returns {f0, voiced, frame_seconds} for a take, from cache when possible."""
+        content_hash = fingerprint_audio_file(input_path)
+        with self._lock:
+            if content_hash in self._memo:
+                return self._memo[content_hash]
+        # A concurrent request for the same take waits and then finds the memo
+        with self._analysis_locks.hold(content_hash):
+            with self._lock:
+                if content_hash in self._memo:
+                    return self._memo[content_hash]
+            analysis = self._load_or_track(input_path, content_hash)
+            with self._lock:
+                self._memo[content_hash] = analysis
+            return analysis
+
+    def _load_or_track(self, input_path: str, content_hash: str) -> dict:
+        path = os.path.join(self.dir, f"{content_hash}.npz")
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    if int(data["version"]) == F0_VERSION:
+                        return {"f0": data["f0"], "voiced": data["voiced"],
+                                "frame_seconds": float(data["frame_seconds"])}
+            except Exception as e:
+                print(f"Error reading F0 cache {path}: {e}")
+
+        y, _ = librosa.load(input_path, sr=ANALYSIS_SR, mono=True)
+        f0, voiced = track_f0(y, ANALYSIS_SR)
+        analysis = {"f0": f0, "voiced": voiced, "frame_seconds": ANALYSIS_HOP / ANALYSIS_SR}
+        # Unique per process, in case another worker process tracks the same take
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, version=F0_VERSION, **analysis)
+        os.replace(tmp_path, path)
+        return analysis
+
+    def correct(self, input_path: str, output_path: str, key: str, strength: float = 1.0,
+                semitones: float = 0.0, retune_ms: float = 60.0) -> dict:
+        """
+        Writes the corrected take to output_path. strength (0-1) is how far
+        notes are pulled onto the scale; semitones adds a fixed transpose;
+        retune_ms is how quickly the correction follows the singer.
+        Returns {output_path, segments, mean_correction} (the latter in semitones).
+        """
+        analysis = self.analyze(input_path)
+        frame_seconds = analysis["frame_seconds"]
+        curve = correction_curve(analysis["f0"], analysis["voiced"], scale_pitch_classes(key),
+                                 strength, retune_ms / 1000.0 / frame_seconds) + semitones
+
+        with open_audio(input_path) as reader:
+            samplerate = reader.samplerate
+            segments = correction_segments(curve, frame_seconds, samplerate, reader.frames, semitones)
+            with self.chains.checkout(("pitch-correct",), lambda: Pedalboard([PitchShift()])) as board, \
+                    AudioFile(output_path, "w", samplerate, reader.num_channels) as out:
+                for block in self._render(reader, board, segments):
+                    out.write(block)
+
+        voiced = analysis["voiced"]
+        return {
+            "output_path": output_path,
+            "segments": len(segments),
+            "mean_correction": float(np.mean(np.abs(curve[voiced] - semitones))) if voiced.any() else 0.0,
+        }
+
+    def _render(self, reader, board, segments):
+        """
+        Yields the output in order. Each segment is rendered on its own (with
+        pre-roll if shifted) and joined to the previous one by a ChunkSplicer,
+        in phase within +-SEARCH_SECONDS and crossfaded over FADE_SECONDS.
+        Output length equals input length.
+        """
+        samplerate = reader.samplerate
+        search = int(SEARCH_SECONDS * samplerate)
+        preroll = int(PREROLL_SECONDS * samplerate)
+        splicer = ChunkSplicer(max(1, int(FADE_SECONDS * samplerate)), search)
+
+        for i, (start, end, shift) in enumerate(segments):
+            # Render from far enough back to cover the whole splice search range
+            lo = max(0, start - splicer.fade - 2 * search) if i else 0
+            read_from = max(0, lo - preroll) if shift else lo
+            reader.seek(read_from)
+            audio = reader.read(end - read_from)
+            if shift:
+                board[0].semitones = shift
+                audio = board(audio, samplerate, reset=True)
+            audio = audio[:, lo - read_from:]
+            if audio.shape[1] < end - lo:
+                audio = np.pad(audio, ((0, 0), (0, end - lo - audio.shape[1])))
+            # The previous segment's output ends where this one starts
+            yield from splicer.add(audio, start - lo)
+
+        yield from splicer.finish(reader.frames)
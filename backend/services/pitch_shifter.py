@@ -0,0 +1,80 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.stem_cache import StemCache, fingerprint_audio_file
+
+
+class StemPitchShifter:
+    """
+    Transposes stems on a worker pool (Pedalboard releases the GIL while it
+    processes). Renders are memoized in the stem cache by (stem content hash,
+    semitones), and identical requests that arrive while a render is running
+    wait for that render instead of starting another one.
+    """
+
+    def __init__(self, mixer, stem_cache: StemCache, max_workers=None):
+        self.mixer = mixer
+        self.stem_cache = stem_cache
+        if max_workers is None:
+            max_workers = int(os.environ.get("PITCH_WORKERS", os.cpu_count() or 4))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pitch")
+        # Pre-renders are fed to the pool one at a time so they never queue ahead of user requests
+        self.prerender_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prerender")
+
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _render(self, input_path: str, output_path: str, semitones: int, cache_key: str):
+        self.mixer.pitch_shift(input_path, output_path, semitones)
+        self.stem_cache.store(cache_key, {"audio": output_path}, {"source": input_path, "semitones": semitones})
+        return output_path
+
+    def submit(self, input_path: str, semitones: int):
+        """Returns a future for the path of input_path shifted by semitones."""
+        cache_key = StemCache.make_key(fingerprint_audio_file(input_path), "pitchshift", {"semitones": semitones})
+
+        with self._lock:
+            future = self._inflight.get(cache_key)
+            if future is not None:
+                return future
+
+            cached = self.stem_cache.lookup(cache_key)
+            if cached:
+                future = Future()
+                future.set_result(cached["audio"])
+                return future
+
+            base, ext = os.path.splitext(input_path)
+            output_path = f"{base}_shifted_{semitones}{ext}"
+            future = self.executor.submit(self._render, input_path, output_path, semitones, cache_key)
+            self._inflight[cache_key] = future
+
+        def _done(_):
+            with self._lock:
+                self._inflight.pop(cache_key, None)
+        future.add_done_callback(_done)
+        return future
+
+    def shift_stems(self, stems: dict, semitones: int) -> dict:
+        """
+        Shifts every stem concurrently.
+        stems: dict of {stem_name: file_path}; returns {stem_name: shifted_path}.
+        """
+        futures = {name: self.submit(path, semitones) for name, path in stems.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def prerender(self, stems: dict, max_semitones: int):
+        """Queues the ±1..max_semitones variants of every stem in the background."""
+        steps = [s for n in range(1, max_semitones + 1) for s in (n, -n)]
+
+        def _queue_all():
+            print(f"Pre-rendering transposes {steps} for {len(stems)} stems...")
+            for semitones in steps:
+                for path in stems.values():
+                    try:
+                        self.submit(path, semitones).result()
+                    except Exception as e:
+                        print(f"Pre-render failed for {path} ({semitones:+d}): {e}")
+
+        self.prerender_executor.submit(_queue_all)
@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import librosa
+import numpy as np
+
+from services.atomic_json import write_json
+from services.stem_cache import fingerprint_audio_file
+
+FEATURE_SAMPLE_RATE = 22050
+FEATURE_N_FFT = 2048
+FEATURE_HOP = 512
+# Bump when the extractor changes so stale entries are recomputed
+FEATURE_VERSION = 2
+# Frames quieter than this (dBFS) are left out of loudness, like a loudness gate
+SILENCE_GATE_DB = -70.0
+
+
+def extract_features(y: np.ndarray, sr: int) -> dict:
+    """
+    Mixing features of a (reference) vocal from one magnitude STFT plus a
+    time-domain RMS pass: brightness (mean spectral centroid, Hz),
+    dynamic_range (max - min frame RMS), loudness_db (gated RMS level, dBFS)
+    and spectral_tilt (dB per octave, 100 Hz-10 kHz; more negative is darker).
+    """
+    S = np.abs(librosa.stft(y, n_fft=FEATURE_N_FFT, hop_length=FEATURE_HOP))
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=FEATURE_N_FFT)
+
+    # Centroid per frame; silent frames count as 0, as in librosa.feature.spectral_centroid
+    magnitude = S.sum(axis=0)
+    centroid = np.divide(freqs @ S, magnitude, out=np.zeros_like(magnitude), where=magnitude > 0)
+
+    # Frame RMS in the time domain with the same frames as the STFT, as the
+    # original librosa.feature.rms(y=y) analysis did. The windowed spectrum
+    # can't give this exactly: the Hann taper weights each frame's centre,
+    # which overstated dynamic_range by ~12% on real vocals.
+    rms = librosa.feature.rms(y=y, frame_length=FEATURE_N_FFT, hop_length=FEATURE_HOP)[0]
+    power = S ** 2
+
+    rms_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    gated = rms[rms_db > SILENCE_GATE_DB]
+    loudness_db = 10 * np.log10(np.mean(gated ** 2)) if gated.size else SILENCE_GATE_DB
+
+    # Slope of the long-term spectrum against log frequency
+    band = (freqs >= 100) & (freqs <= 10000)
+    spectrum_db = 10 * np.log10(np.maximum(power[band].mean(axis=1), 1e-20))
+    tilt = np.polyfit(np.log2(freqs[band]), spectrum_db, 1)[0] if band.sum() > 1 else 0.0
+
+    return {
+        "brightness": float(centroid.mean()) if centroid.size else 0.0,
+        "dynamic_range": float(rms.max() - rms.min()) if rms.size else 0.0,
+        "loudness_db": float(loudness_db),
+        "spectral_tilt": float(tilt),
+        "reverb_estimate": 0.3, # Placeholder for complex reverb estimation
+    }
+
+
+class ReferenceFeatureStore:
+    """
+    Reference features keyed by the audio's content hash: one JSON file per
+    entry under temp_audio/features, plus an in-memory memo. Features are
+    computed once per stem (prefetch() right after separation), so /mix only
+    does a lookup. Concurrent requests for the same stem share one computation.
+    """
+
+    def __init__(self, root="temp_audio"):
+        self.dir = os.path.join(root, "features")
+        os.makedirs(self.dir, exist_ok=True)
+        self._memo = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="features")
+
+    def _path(self, content_hash):
+        return os.path.join(self.dir, f"{content_hash}.json")
+
+    def _load(self, content_hash):
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except Exception as e:
+            print(f"Error reading features {path}: {e}")
+            return None
+        return entry if entry.get("version") == FEATURE_VERSION else None
+
+    def _compute(self, audio_path, content_hash):
+        started = time.perf_counter()
+        y, sr = librosa.load(audio_path, sr=FEATURE_SAMPLE_RATE, mono=True)
+        entry = {"version": FEATURE_VERSION, **extract_features(y, sr)}
+        write_json(self._path(content_hash), entry)
+        print(f"Reference features for {audio_path} in {time.perf_counter() - started:.2f}s")
+        return entry
+
+    def _future(self, audio_path):
+        """Memoized result, or the (possibly new) computation for this file's content."""
+        content_hash = fingerprint_audio_file(audio_path)
+        with self._lock:
+            if content_hash in self._memo:
+                return self._memo[content_hash], None
+            future = self._inflight.get(content_hash)
+            if future is None:
+                entry = self._load(content_hash)
+                if entry:
+                    self._memo[content_hash] = entry
+                    return entry, None
+                future = self.executor.submit(self._compute, audio_path, content_hash)
+                self._inflight[content_hash] = future
+
+        def _done(done):
+            with self._lock:
+                self._inflight.pop(content_hash, None)
+                if done.exception() is None:
+                    self._memo[content_hash] = done.result()
+        future.add_done_callback(_done)
+        return None, future
+
+    def prefetch(self, audio_path):
+        """Starts computing features in the background (no-op if already known)."""
+        self._future(audio_path)
+
+    def get(self, audio_path) -> dict:
+        """Features for audio_path, computing them now if they aren't stored yet."""
+        entry, future = self._future(audio_path)
+        if future is not None:
+            entry = future.result()
+        return {k: v for k, v in entry.items() if k != "version"}
@@ -0,0 +1,137 @@
+import os
+import threading
+from pathlib import Path
+
+from services.torch_threads import configure_torch_threads
+
+STEM_NAMES = ["vocals", "drums", "bass", "other"]
+
+# One engine per model per worker process. The model weights are the
+# expensive part, so every AudioProcessor in the process shares them.
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class SeparationEngine:
+    """
+    Resident Demucs separator.
+    Loads the model once, keeps it warm and runs apply_model in-process instead
+    of spawning `python -m demucs` for every track.
+    """
+
+    def __init__(self, model_name="htdemucs", device=None, segment=None, overlap=0.25, shifts=1):
+        self.model_name = model_name
+        self.device = device or os.environ.get("DEMUCS_DEVICE") or None
+        self.segment = segment
+        self.overlap = overlap
+        self.shifts = shifts
+
+        self._model = None
+        self._load_lock = threading.Lock()
+        # apply_model is not re-entrant on a shared model; serialize inference.
+        self._run_lock = threading.Lock()
+
+    @property
+    def samplerate(self) -> int:
+        return self.model.samplerate
+
+    @property
+    def audio_channels(self) -> int:
+        return self.model.audio_channels
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self):
+        """Loads the model weights (once). Safe to call from several threads."""
+        with self._load_lock:
+            if self._model is not None:
+                return self._model
+
+            import torch
+            from demucs.pretrained import get_model
+
+            configure_torch_threads()
+            if self.device is None:
+                self.device = "cuda" if torch.cuda.is_available() else "cpu"
+
+            print(f"Loading Demucs model ({self.model_name}) on {self.device}...")
+            model = get_model(self.model_name)
+            model.to(self.device)
+            model.eval()
+            self._model = model
+            return self._model
+
+    def load_audio(self, audio_path: str):
+        """
+        Decodes audio to a (channels, samples) float tensor at the model's
+        sample rate, the same way the demucs CLI does.
+        """
+        from demucs.audio import AudioFile
+
+        return AudioFile(audio_path).read(
+            streams=0,
+            samplerate=self.samplerate,
+            channels=self.audio_channels,
+        )
+
+    def separate(self, wav, out_dir) -> dict:
+        """
+        Separates a decoded waveform and writes <out_dir>/<stem>.wav.
+        Returns a dictionary of stem name -> path.
+        """
+        import torch
+        from demucs.apply import apply_model
+        from demucs.audio import save_audio
+
+        model = self.model
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        # Same normalization as demucs.separate
+        ref = wav.mean(0)
+        mean, std = ref.mean(), ref.std()
+        wav = (wav - mean) / (std + 1e-8)
+
+        with self._run_lock, torch.no_grad():
+            sources = apply_model(
+                model,
+                wav[None],
+                device=self.device,
+                shifts=self.shifts,
+                split=True,
+                overlap=self.overlap,
+                segment=self.segment,
+                progress=False,
+            )[0]
+        sources = sources * std + mean
+
+        stems = {}
+        for source, name in zip(sources, model.sources):
+            stem_path = out_dir / f"{name}.wav"
+            save_audio(source.cpu(), stem_path, samplerate=model.samplerate)
+            stems[name] = str(stem_path)
+        return stems
+
+
+def get_separation_engine(model_name="htdemucs") -> SeparationEngine:
+    """
+    Returns the shared engine for this worker, configured from the environment:
+    DEMUCS_SEGMENT (seconds), DEMUCS_OVERLAP, DEMUCS_SHIFTS. Threads come from
+    the process-wide budget (TORCH_THREADS, see configure_torch_threads).
+    """
+    with _engines_lock:
+        engine = _engines.get(model_name)
+        if engine is None:
+            segment = os.environ.get("DEMUCS_SEGMENT")
+            engine = SeparationEngine(
+                model_name=model_name,
+                segment=float(segment) if segment else None,
+                overlap=float(os.environ.get("DEMUCS_OVERLAP", 0.25)),
+                shifts=int(os.environ.get("DEMUCS_SHIFTS", 1)),
+            )
+            _engines[model_name] = engine
+        return engine
@@ -1,125 +1,244 @@
 import librosa
 import numpy as np
 import soundfile as sf
+from scipy import signal
 from pedalboard import Pedalboard, Compressor, Reverb, HighpassFilter, LowpassFilter, Gain, PitchShift
 from pedalboard.io import AudioFile
 
+from services.audio_stream import open_audio, process_chunked, process_stream, read_blocks
+from services.effect_chains import ChainRegistry
+from services.pitch_correction import PitchCorrector
+from services.reference_features import ReferenceFeatureStore
+
+# How long the reverb is allowed to ring past the end of a take
+REVERB_TAIL_SECONDS = 2.0
+ALIGN_BLOCK_FRAMES = 1 << 16
+# Take alignment runs on onset envelopes at 100 frames/s (8 kHz, hop 80)
+ALIGN_ANALYSIS_SR = 8000
+ALIGN_ANALYSIS_HOP = 80
+# Read PCM in its own width so aligned copies are bit-exact
+_SUBTYPE_DTYPES = {
+    "PCM_16": "int16",
+    "PCM_24": "int32",
+    "PCM_32": "int32",
+    "FLOAT": "float32",
+    "DOUBLE": "float64",
+}
+
+
+def _onset_envelope(y: np.ndarray, sr: int, hop: int) -> np.ndarray:
+    """Onset strength, standardized so takes and references at different levels compare."""
+    if y.size < 4 * hop:
+        return np.zeros(0)
+    env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop, n_fft=4 * hop)
+    # ~50 ms smoothing: frame-level jitter from noise or breath shouldn't decide the match
+    env = np.convolve(env, np.hanning(7)[1:-1] / np.hanning(7)[1:-1].sum(), mode="same")
+    std = env.std()
+    return (env - env.mean()) / std if std > 0 else env - env.mean()
+
 class SmartMixer:
-    def __init__(self):
-        pass
+    def __init__(self, root="temp_audio"):
+        self.features = ReferenceFeatureStore(root=root)
+        # Configured Pedalboard chains, reused across requests
+        self.chains = ChainRegistry()
+        self.corrector = PitchCorrector(self.chains, root=root)
 
     def analyze_reference(self, reference_path: str):
         """
         Analyzes the reference vocal track to extract mixing parameters.
-        Returns a dictionary of parameters (brightness, dynamics, reverb_amount).
+        Returns a dictionary of parameters (brightness, dynamic_range,
+        reverb_estimate, loudness_db, spectral_tilt).
+        Features are stored by content hash, so a reference is analyzed once.
         """
-        y, sr = librosa.load(reference_path)
-        
-        # 1. Brightness (Spectral Centroid)
-        centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-        brightness = np.mean(centroid)
-        
-        # 2. Dynamics (RMS)
-        rms = librosa.feature.rms(y=y)
-        dynamic_range = np.max(rms) - np.min(rms)
-        
-        # 3. Reverb (Estimate based on decay - simplified)
-        # This is hard to estimate accurately without clean dry/wet, 
-        # but we can look at the tail energy.
-        
-        return {
-            "brightness": float(brightness),
-            "dynamic_range": float(dynamic_range),
-            "reverb_estimate": 0.3 # Placeholder for complex reverb estimation
-        }
+        return self.features.get(reference_path)
 
-    def apply_mix(self, input_path: str, output_path: str, reference_params: dict, strength: float = 1.0):
-        """
-        Applies mixing effects to the input audio based on reference parameters.
-        Strength (0.0 to 1.0) controls the intensity of the match.
-        """
-        # Read audio
-        with AudioFile(input_path) as f:
-            audio = f.read(f.frames)
-            samplerate = f.samplerate
+    def _mix_chain_params(self, reference_params: dict, strength: float) -> tuple:
+        """The settings apply_mix derives from the reference, as a chain registry key."""
+        # If reference is bright, clean the mud
+        highpass = reference_params["brightness"] > 3000
+        # If reference has low dynamic range, compress heavily
+        threshold = round(-20.0 * strength, 2)
+        ratio = round(2.0 + (2.0 * strength), 2)
+        room_size = round(reference_params["reverb_estimate"] * strength, 3)
+        wet_level = round(0.3 * strength, 3)
+        return ("mix", highpass, threshold, ratio, room_size, wet_level)
 
-        # Create Board
+    @staticmethod
+    def _build_mix_chain(params: tuple) -> Pedalboard:
+        _, highpass, threshold, ratio, room_size, wet_level = params
         board = Pedalboard()
         
         # 1. EQ (Brightness match)
-        # If reference is bright, boost highs.
-        if reference_params["brightness"] > 3000:
+        if highpass:
             board.append(HighpassFilter(cutoff_frequency_hz=200)) # Clean mud
             # In a real app, we'd use a parametric EQ here
         
         # 2. Compression (Dynamics match)
-        # If reference has low dynamic range, compress heavily.
-        threshold = -20.0 * strength
-        ratio = 2.0 + (2.0 * strength)
         board.append(Compressor(threshold_db=threshold, ratio=ratio))
         
         # 3. Reverb
-        room_size = reference_params["reverb_estimate"] * strength
         if room_size > 0:
-            board.append(Reverb(room_size=room_size, wet_level=0.3 * strength))
+            board.append(Reverb(room_size=room_size, wet_level=wet_level))
+        return board
 
-        # Process
-        processed = board(audio, samplerate)
+    def apply_mix(self, input_path: str, output_path: str, reference_params: dict, strength: float = 1.0):
+        """
+        Applies mixing effects to the input audio based on reference parameters.
+        Strength (0.0 to 1.0) controls the intensity of the match.
+
+        The take is streamed through a pooled chain block by block, so memory
+        stays flat for long takes; the reverb tail is rendered past the end.
+        """
+        params = self._mix_chain_params(reference_params, strength)
+        tail_seconds = REVERB_TAIL_SECONDS if params[4] > 0 else 0.0
 
-        # Save
-        with AudioFile(output_path, 'w', samplerate, processed.shape[0]) as f:
-            f.write(processed)
+        with open_audio(input_path) as reader, \
+                self.chains.checkout(params, lambda: self._build_mix_chain(params)) as board:
+            samplerate = reader.samplerate
+            with AudioFile(output_path, 'w', samplerate, reader.num_channels) as out:
+                for block in process_stream(board, read_blocks(reader), samplerate, tail_seconds):
+                    out.write(block)
             
         return output_path
 
-    def apply_autotune(self, input_path: str, output_path: str, key: str, strength: float = 1.0):
+    def apply_autotune(self, input_path: str, output_path: str, key: str, strength: float = 1.0,
+                       semitones: float = 0.0, retune_ms: float = 60.0):
         """
-        Simple pitch correction.
-        Note: High quality autotune is complex. We will use a simple pitch shifter 
-        guided by the key for this MVP, or just a static pitch shift if requested.
-        
-        Real autotune requires a vocoder or pitch correction library like Autotalent.
-        For now, we will implement a simple 'PitchShift' if the user wants to change key,
-        as 'Auto-tune' usually implies correcting to nearest note.
+        Pitch correction: pulls the take's notes onto the scale of key
+        (as detect_key names it, e.g. "C Major"). strength (0-1) is how far,
+        retune_ms how fast; semitones adds a fixed transpose on top.
+        The take's F0 track is cached, so re-tuning only re-renders.
+        Returns {output_path, segments, mean_correction}.
         """
-        # For this MVP, we will just implement the Pitch Shift feature requested
-        # "reduce the pitch by how many every semitones I want to"
-        
-        # If strength is treated as semitones for shifting:
-        semitones = int(strength)
-        
-        with AudioFile(input_path) as f:
-            audio = f.read(f.frames)
-            samplerate = f.samplerate
-            
-        board = Pedalboard([
-            PitchShift(semitones=semitones)
-        ])
-        
-        processed = board(audio, samplerate)
-        
-        with AudioFile(output_path, 'w', samplerate, processed.shape[0]) as f:
-            f.write(processed)
-            
+        return self.corrector.correct(input_path, output_path, key, strength, semitones, retune_ms)
+
+    def pitch_shift(self, input_path: str, output_path: str, semitones: float):
+        """
+        Transposes the whole file by a fixed number of semitones, streaming
+        through a pooled PitchShift chain in overlapping chunks, so memory
+        stays flat however many stems are shifted at once.
+        """
+        key = ("pitch", float(semitones))
+        with open_audio(input_path) as reader, \
+                self.chains.checkout(key, lambda: Pedalboard([PitchShift(semitones=semitones)])) as board:
+            samplerate = reader.samplerate
+            with AudioFile(output_path, 'w', samplerate, reader.num_channels) as out:
+                for block in process_chunked(board, read_blocks(reader), samplerate):
+                    out.write(block)
+
         return output_path
 
     def align_audio(self, input_path: str, output_path: str, start_time: float):
         """
-        Pads the beginning of the audio file with silence corresponding to start_time.
+        Writes a copy of the recording that starts start_time seconds later
+        (negative trims the start instead). Only for when a real file is needed;
+        normally the offset is stored and applied while streaming.
+
+        Frames are streamed block by block in the source's own sample type, so
+        channels, rate and bit depth are kept and the file is never fully in memory.
         """
-        # Load audio
-        y, sr = librosa.load(input_path, sr=None) # Keep original SR
-        
-        # Calculate silence samples
-        num_silent_samples = int(start_time * sr)
-        
-        if num_silent_samples > 0:
-            silence = np.zeros(num_silent_samples)
-            # Concatenate
-            y_aligned = np.concatenate((silence, y))
-        else:
-            y_aligned = y
-            
-        # Save
-        sf.write(output_path, y_aligned, sr)
+        try:
+            source = sf.SoundFile(input_path)
+        except RuntimeError:
+            # Not a format libsndfile reads (e.g. webm from the browser): decode it instead
+            return self._align_decoded(input_path, output_path, start_time)
+
+        with source:
+            dtype = _SUBTYPE_DTYPES.get(source.subtype, "float32")
+            # PCM and float keep their subtype; compressed sources become 32-bit float
+            subtype = source.subtype if source.subtype in _SUBTYPE_DTYPES else "FLOAT"
+            offset = int(round(start_time * source.samplerate))
+            with sf.SoundFile(output_path, "w", samplerate=source.samplerate, channels=source.channels,
+                              subtype=subtype, format="WAV") as out:
+                silence = np.zeros((min(max(offset, 0), ALIGN_BLOCK_FRAMES), source.channels), dtype=dtype)
+                remaining = max(offset, 0)
+                while remaining > 0:
+                    n = min(remaining, ALIGN_BLOCK_FRAMES)
+                    out.write(silence[:n])
+                    remaining -= n
+                if offset < 0:
+                    source.seek(min(-offset, source.frames))
+                for block in source.blocks(blocksize=ALIGN_BLOCK_FRAMES, dtype=dtype, always_2d=True):
+                    out.write(block)
+        return output_path
+
+    def estimate_alignment(self, recording_path: str, reference_path: str, start_time: float = 0.0,
+                           search_seconds: float = 1.0, analysis_seconds: float = 30.0) -> dict:
+        """
+        Measures where a recorded take really starts in the song by
+        cross-correlating its onset envelope with the reference vocals.
+        Only offsets within search_seconds of start_time (the client's guess)
+        are considered, and only the first analysis_seconds of the take are
+        used, so the cost doesn't grow with song length.
+        Returns {offset, confidence (0-1), latency (offset - start_time)}.
+        """
+        sr, hop = ALIGN_ANALYSIS_SR, ALIGN_ANALYSIS_HOP
+        hop_seconds = hop / sr
+
+        take, _ = librosa.load(recording_path, sr=sr, mono=True, duration=analysis_seconds)
+        ref_start = max(0.0, start_time - search_seconds)
+        reference, _ = librosa.load(reference_path, sr=sr, mono=True, offset=ref_start,
+                                    duration=(start_time - ref_start) + search_seconds + len(take) / sr)
+
+        take_env = _onset_envelope(take, sr, hop)
+        ref_env = _onset_envelope(reference, sr, hop)
+        if take_env.size < 2 or ref_env.size < 2:
+            return {"offset": float(start_time), "confidence": 0.0, "latency": 0.0}
+
+        # corr[k] = sum(ref[n + k] * take[n]), for lags k that keep the take inside the window
+        corr = signal.correlate(ref_env, take_env, mode="full", method="fft")[take_env.size - 1:]
+        expected = (start_time - ref_start) / hop_seconds
+        window = int(np.ceil(search_seconds / hop_seconds))
+        lo = max(0, int(expected) - window)
+        hi = min(corr.size, int(expected) + window + 1)
+        if hi <= lo:
+            return {"offset": float(start_time), "confidence": 0.0, "latency": 0.0}
+        lag = lo + int(np.argmax(corr[lo:hi]))
+
+        # Pearson correlation over the overlapping frames at the chosen lag
+        overlap = min(take_env.size, ref_env.size - lag)
+        a, b = take_env[:overlap], ref_env[lag:lag + overlap]
+        denom = np.linalg.norm(a - a.mean()) * np.linalg.norm(b - b.mean())
+        confidence = float(np.dot(a - a.mean(), b - b.mean()) / denom) if denom > 0 else 0.0
+
+        # Parabolic interpolation around the peak for sub-frame precision
+        refined = float(lag)
+        if 0 < lag < corr.size - 1:
+            left, centre, right = corr[lag - 1], corr[lag], corr[lag + 1]
+            curvature = left - 2 * centre + right
+            if curvature < 0:
+                refined += 0.5 * (left - right) / curvature
+
+        offset = ref_start + refined * hop_seconds
+        return {
+            "offset": float(offset),
+            "confidence": max(0.0, confidence),
+            "latency": float(offset - start_time),
+        }
+
+    def auto_align(self, input_path: str, reference_path: str, start_time: float = 0.0,
+                   output_path: str = None, min_confidence: float = 0.2, **options) -> dict:
+        """
+        estimate_alignment, falling back to start_time when the match is weak.
+        With output_path, the take is also written out aligned via align_audio.
+        Returns the estimate plus the offset actually used ("applied").
+        """
+        estimate = self.estimate_alignment(input_path, reference_path, start_time, **options)
+        applied = estimate["offset"] if estimate["confidence"] >= min_confidence else start_time
+        if output_path:
+            self.align_audio(input_path, output_path, applied)
+        return {**estimate, "applied": float(applied)}
+
+    def _align_decoded(self, input_path: str, output_path: str, start_time: float):
+        """align_audio for compressed input: decode in blocks, write 32-bit float WAV."""
+        from services.audio_stream import offset_blocks
+        with open_audio(input_path) as reader:
+            samplerate = reader.samplerate
+            channels = reader.num_channels
+            blocks = offset_blocks(read_blocks(reader, ALIGN_BLOCK_FRAMES),
+                                   int(round(start_time * samplerate)), channels, ALIGN_BLOCK_FRAMES)
+            with sf.SoundFile(output_path, "w", samplerate=int(samplerate), channels=channels,
+                              subtype="FLOAT", format="WAV") as out:
+                for block in blocks:
+                    out.write(block.T)
         return output_path
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.atomic_json import write_json
+
+CACHE_INDEX = "stem_cache.json"
+
+
+def fingerprint_array(audio: np.ndarray) -> str:
+    """Content hash of decoded audio samples (shape and dtype included)."""
+    audio = np.ascontiguousarray(audio)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{audio.dtype}{audio.shape}".encode())
+    h.update(memoryview(audio).cast("B"))
+    return h.hexdigest()
+
+
+# (path, size, mtime) -> hash, so unchanged files are only hashed once
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def fingerprint_audio_file(path: str, block_frames: int = 1 << 18) -> str:
+    """
+    Content hash of an audio file's decoded samples, read in blocks so memory
+    stays flat. Falls back to hashing raw bytes for formats soundfile can't read.
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_hashes_lock:
+        if memo_key in _file_hashes:
+            return _file_hashes[memo_key]
+
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        import soundfile as sf
+        with sf.SoundFile(path) as f:
+            h.update(f"{f.samplerate}:{f.channels}".encode())
+            for block in f.blocks(blocksize=block_frames, dtype="float32", always_2d=True):
+                h.update(memoryview(np.ascontiguousarray(block)).cast("B"))
+    except Exception:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+    digest = h.hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = digest
+    return digest
+
+
+class StemCache:
+    """
+    Content-addressed cache of rendered audio (separated stems, pitch-shifted
+    stems, ...). Entries are keyed by audio hash + model/operation + params and
+    tracked in a JSON manifest. When the total size exceeds the budget, least
+    recently used entries are deleted from disk.
+    """
+
+    def __init__(self, root="temp_audio", max_bytes=None):
+        self.root = root
+        self.index_path = os.path.join(root, CACHE_INDEX)
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("STEM_CACHE_MAX_MB", 4096)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.RLock()
+        self.entries = {}
+        self._load()
+
+    @staticmethod
+    def make_key(content_hash: str, model: str, params: dict = None) -> str:
+        payload = json.dumps({"audio": content_hash, "model": model, "params": params or {}}, sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                self.entries = json.load(f).get("entries", {})
+        except Exception as e:
+            print(f"Error loading stem cache index: {e}")
+            self.entries = {}
+
+    def _save(self):
+        write_json(self.index_path, {"entries": self.entries})
+
+    def lookup(self, key: str):
+        """Returns the cached {name: path} dict, or None on a miss."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and all(os.path.exists(p) for p in entry["files"].values()):
+                self.hits += 1
+                entry["last_access"] = time.time()
+                self._save()
+                return dict(entry["files"])
+
+            if entry:
+                # Files were removed behind our back
+                del self.entries[key]
+                self._save()
+            self.misses += 1
+            return None
+
+    def store(self, key: str, files: dict, meta: dict = None):
+        """Registers rendered files under key and evicts LRU entries over budget."""
+        size = sum(os.path.getsize(p) for p in files.values() if os.path.exists(p))
+        now = time.time()
+        with self._lock:
+            self.entries[key] = {
+                "files": dict(files),
+                "bytes": size,
+                "meta": meta or {},
+                "created": now,
+                "last_access": now,
+            }
+            self._evict(keep=key)
+            self._save()
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(e["bytes"] for e in self.entries.values())
+
+    def _evict(self, keep=None):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            total -= entry["bytes"]
+            self.evictions += 1
+            print(f"Evicting cached audio {key[:12]} ({entry['bytes'] / 1e6:.1f} MB)")
+            for p in entry["files"].values():
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                # Drop the stem folder once it's empty
+                try:
+                    os.rmdir(os.path.dirname(p))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.total_bytes(),
+                "max_bytes": self.max_bytes,
+            }
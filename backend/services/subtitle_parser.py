@@ -0,0 +1,151 @@
+import html
+import re
+
+import numpy as np
+
+# "00:01:02.345 --> 00:01:04.000 align:start position:0%"
+_TIMING = re.compile(r"^\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})\s+-->\s+((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})")
+# Word timestamps inside YouTube auto-captions: "hello<00:00:01.500><c> world</c>"
+_INLINE_TIME = re.compile(r"<((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})>")
+_TAG = re.compile(r"<[^>]*>")
+# Snapshot cues YouTube inserts between rolling lines are ~10 ms long
+_SNAPSHOT_SECONDS = 0.05
+
+
+def parse_timestamp(value: str) -> float:
+    """"HH:MM:SS.mmm" or "MM:SS.mmm" -> seconds."""
+    seconds = 0.0
+    for part in value.replace(",", ".").split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def _clean(text: str) -> str:
+    return html.unescape(_TAG.sub("", text)).strip()
+
+
+def iter_cues(lines):
+    """Yields (start, end, [raw text lines]) for each cue in a stream of VTT lines."""
+    start = end = None
+    text = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        match = _TIMING.match(line)
+        if match:
+            if start is not None and text:
+                yield start, end, text
+            start, end = parse_timestamp(match.group(1)), parse_timestamp(match.group(2))
+            text = []
+        elif not line:
+            # Only a truly empty line ends a cue; YouTube pads cues with " " lines
+            if start is not None and text:
+                yield start, end, text
+            start, text = None, []
+        elif start is not None:
+            text.append(line)
+    if start is not None and text:
+        yield start, end, text
+
+
+def _line_spans(line: str, start: float, end: float) -> list:
+    """
+    Splits one caption line with inline word timestamps into (start, end, words)
+    spans, one per timed piece.
+    """
+    pieces = _INLINE_TIME.split(line)
+    # pieces alternates text, timestamp, text, ...
+    times = [start] + [parse_timestamp(t) for t in pieces[1::2]] + [end]
+    spans = []
+    for i, piece in enumerate(pieces[::2]):
+        words = _clean(piece).split()
+        if words:
+            spans.append((times[i], max(times[i], times[i + 1]), words))
+    return spans
+
+
+def parse_vtt_lines(lines) -> dict:
+    """
+    Parses VTT lines into columns: {words: [str], starts: float array, ends: float array}.
+
+    YouTube auto-captions scroll: each cue repeats the previous line above the
+    new one, and ~10 ms snapshot cues repeat it on its own. A line equal to the
+    previous cue's last line is dropped when it isn't the newest line of its
+    cue or sits in a snapshot cue, so every word appears once. Repeated lines in
+    ordinary captions (a chorus "Hey!" twice) are kept.
+    """
+    spans = []
+    previous_last = None
+    for start, end, text in iter_cues(lines):
+        cleaned = [_clean(line) for line in text]
+        snapshot = end - start < _SNAPSHOT_SECONDS
+        last = None
+        # Lines without word timestamps share one span, so their words are
+        # spread over the cue once, in reading order
+        untimed = None
+        for i, (line, plain) in enumerate(zip(text, cleaned)):
+            if not plain:
+                continue
+            newest = i == len(cleaned) - 1 or not any(cleaned[i + 1:])
+            if plain == previous_last and (snapshot or not newest):
+                last = plain
+                continue
+            last = plain
+            if _INLINE_TIME.search(line):
+                spans.extend(_line_spans(line, start, end))
+            elif untimed is None:
+                untimed = (start, end, plain.split())
+                spans.append(untimed)
+            else:
+                untimed[2].extend(plain.split())
+        if last is not None:
+            previous_last = last
+
+    if not spans:
+        return {"words": [], "starts": np.zeros(0), "ends": np.zeros(0)}
+
+    # Spread each span's words evenly over it, all spans at once
+    counts = np.array([len(words) for _, _, words in spans])
+    span_starts = np.array([s for s, _, _ in spans])
+    span_ends = np.array([e for _, e, _ in spans])
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    index = np.arange(counts.sum()) - np.repeat(offsets, counts)
+    step = np.repeat((span_ends - span_starts) / counts, counts)
+    starts = np.repeat(span_starts, counts) + index * step
+    return {
+        "words": [word for _, _, words in spans for word in words],
+        "starts": starts,
+        "ends": starts + step,
+    }
+
+
+def parse_vtt(vtt_path: str) -> dict:
+    """Streams a .vtt file through parse_vtt_lines."""
+    with open(vtt_path, "r", encoding="utf-8-sig") as f:
+        return parse_vtt_lines(f)
+
+
+def to_word_dicts(columns: dict) -> list:
+    """Columns -> [{word, start, end}], the shape the rest of the app uses."""
+    return [
+        {"word": word, "start": start, "end": end}
+        for word, start, end in zip(columns["words"], np.asarray(columns["starts"]).tolist(),
+                                    np.asarray(columns["ends"]).tolist())
+    ]
+
+
+def from_word_dicts(words: list) -> dict:
+    """[{word, start, end}] -> columns."""
+    return {
+        "words": [w["word"] for w in words],
+        "starts": np.array([w["start"] for w in words], dtype=float),
+        "ends": np.array([w["end"] for w in words], dtype=float),
+    }
+
+
+def to_json_columns(columns: dict, decimals: int = 3) -> dict:
+    """Columns as plain lists with times rounded to the millisecond, for API payloads."""
+    return {
+        "words": list(columns["words"]),
+        "starts": np.round(np.asarray(columns["starts"], dtype=float), decimals).tolist(),
+        "ends": np.round(np.asarray(columns["ends"], dtype=float), decimals).tolist(),
+    }
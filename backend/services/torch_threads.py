@@ -0,0 +1,32 @@
+import os
+import threading
+
+_threads = None
+_lock = threading.Lock()
+
+
+def configure_torch_threads():
+    """
+    Sets torch's intra-op thread count for the process, once.
+
+    torch.set_num_threads is process-wide, so Demucs and Whisper share one
+    budget instead of each engine overriding the other when it loads:
+    TORCH_THREADS (DEMUCS_THREADS is still read under its old name), default
+    torch's own setting. The budget is not divided by the Whisper pool, since
+    that would also starve separation while Whisper is idle; how many Whisper
+    calls run at once is bounded by WHISPER_POOL_SIZE instead.
+    Returns the thread count in effect.
+    """
+    global _threads
+    with _lock:
+        if _threads is not None:
+            return _threads
+
+        import torch
+        budget = os.environ.get("TORCH_THREADS") or os.environ.get("DEMUCS_THREADS")
+        threads = max(1, int(budget)) if budget else torch.get_num_threads()
+        if threads != torch.get_num_threads():
+            torch.set_num_threads(threads)
+        _threads = threads
+        print(f"Torch using {threads} threads")
+        return _threads
@@ -0,0 +1,82 @@
+import json
+import os
+import re
+import threading
+import time
+
+from services.atomic_json import write_json
+
+# Language tag in "Title.en.vtt" / "Title.ta.vtt"
+_VTT_LANG = re.compile(r"\.([A-Za-z]{2,3}(?:-[A-Za-z0-9]+)?)\.vtt$")
+# Suffix the stem cache adds when two songs share a title ("Title_1a2b3c4d")
+_COLLISION_SUFFIX = re.compile(r"_[0-9a-f]{8}$")
+
+
+class TranscriptCache:
+    """
+    Lyrics/timing results keyed by the vocals file's content hash, one JSON
+    file per entry under temp_audio/transcripts. Records where the words came
+    from (web, subtitles, whisper) and the language.
+    """
+
+    def __init__(self, root="temp_audio"):
+        self.dir = os.path.join(root, "transcripts")
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _path(self, content_hash):
+        return os.path.join(self.dir, f"{content_hash}.json")
+
+    def get(self, content_hash):
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error reading transcript cache {path}: {e}")
+            return None
+
+    def put(self, content_hash, result: dict):
+        entry = dict(result)
+        entry["cached_at"] = time.time()
+        write_json(self._path(content_hash), entry)
+        return entry
+
+
+class SubtitleIndex:
+    """
+    Maps a track name (the downloaded file's stem, which is also the
+    htdemucs/<track> folder) to its subtitle files by language.
+    Filled in at download time so transcription never scans temp_audio.
+    """
+
+    def __init__(self, root="temp_audio"):
+        self.path = os.path.join(root, "subtitles_index.json")
+        self._lock = threading.Lock()
+        self.tracks = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.tracks = json.load(f)
+            except Exception as e:
+                print(f"Error loading subtitle index: {e}")
+
+    @staticmethod
+    def language_of(vtt_path: str) -> str:
+        match = _VTT_LANG.search(os.path.basename(vtt_path))
+        return match.group(1) if match else "und"
+
+    def register(self, track_name: str, vtt_path: str, language: str = None):
+        language = language or self.language_of(vtt_path)
+        with self._lock:
+            self.tracks.setdefault(track_name, {})[language] = vtt_path
+            write_json(self.path, self.tracks)
+
+    def lookup(self, track_name: str) -> dict:
+        """Returns {language: vtt_path} for files that still exist."""
+        with self._lock:
+            subs = self.tracks.get(track_name)
+            if subs is None:
+                subs = self.tracks.get(_COLLISION_SUFFIX.sub("", track_name), {})
+            return {lang: path for lang, path in subs.items() if os.path.exists(path)}
@@ -0,0 +1,250 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from services.torch_threads import configure_torch_threads
+
+# Whisper works on 16 kHz mono audio
+WHISPER_SAMPLE_RATE = 16000
+
+_service = None
+_service_lock = threading.Lock()
+
+
+class TranscriptionService:
+    """
+    Keeps Whisper resident instead of loading it on every /transcribe.
+    Models are loaded lazily on first use (or with preload()) into a pool of
+    pool_size instances; each request borrows one model for its duration, so
+    requests against a model are serialized.
+    """
+
+    def __init__(self, model_size="small", pool_size=1, device=None,
+                 window_seconds=30.0, overlap_seconds=4.0):
+        self.model_size = model_size
+        self.pool_size = max(1, pool_size)
+        self.device = device
+        # Long-form mode: window length and overlap, in seconds
+        self.window_seconds = window_seconds
+        self.overlap_seconds = overlap_seconds
+
+        self._idle = queue.Queue()
+        self._loaded = 0
+        self._load_lock = threading.Lock()
+
+    def _load_model(self):
+        import whisper
+        # One thread budget for the process, shared with Demucs
+        configure_torch_threads()
+        print(f"Loading Whisper model ({self.model_size})...")
+        return whisper.load_model(self.model_size, device=self.device)
+
+    def preload(self):
+        """Loads every model in the pool up front (e.g. at startup)."""
+        while True:
+            with self._load_lock:
+                if self._loaded >= self.pool_size:
+                    return
+                self._loaded += 1
+            try:
+                self._idle.put(self._load_model())
+            except Exception:
+                with self._load_lock:
+                    self._loaded -= 1
+                raise
+
+    @contextmanager
+    def acquire(self):
+        """Borrows a model, loading another one if the pool isn't full yet."""
+        try:
+            model = self._idle.get_nowait()
+        except queue.Empty:
+            model = None
+            with self._load_lock:
+                grow = self._loaded < self.pool_size
+                if grow:
+                    self._loaded += 1
+            if grow:
+                try:
+                    model = self._load_model()
+                except Exception:
+                    with self._load_lock:
+                        self._loaded -= 1
+                    raise
+            else:
+                model = self._idle.get()
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+    def transcribe(self, audio, **options) -> dict:
+        """
+        Transcribes a file path or 16 kHz float32 array with word timestamps.
+        Returns {words: flat list of {word, start, end}, language}.
+        """
+        with self.acquire() as model:
+            print("Starting transcription...")
+            result = model.transcribe(audio, word_timestamps=True, **options)
+        print(f"Transcription complete. Segments: {len(result['segments'])}")
+        return {"words": words_from_result(result), "language": result.get("language")}
+
+    def transcribe_vocals(self, audio_path: str, vad: bool = True, long_form: bool = None) -> dict:
+        """
+        Transcribes a separated vocal stem, skipping the instrumental gaps.
+        Returns {words, language}, with word times in song time.
+
+        Default: voiced regions (from the RMS envelope) are packed into batches
+        that are transcribed in parallel across the model pool.
+        long_form: regions are cut into overlapping windows instead, one per
+        model call, and words in the overlaps are deduplicated by timestamp.
+        This scales with the pool size; by default it is on when pool_size > 1.
+        """
+        import librosa
+        from services.voice_activity import voiced_regions
+
+        y, _ = librosa.load(audio_path, sr=WHISPER_SAMPLE_RATE, mono=True)
+        duration = len(y) / WHISPER_SAMPLE_RATE
+        regions = voiced_regions(y, WHISPER_SAMPLE_RATE) if vad else [(0.0, duration)]
+        if not regions:
+            return {"words": [], "language": None}
+
+        voiced = sum(end - start for start, end in regions)
+        print(f"Voiced: {voiced:.1f}s of {duration:.1f}s in {len(regions)} regions")
+
+        if long_form is None:
+            long_form = self.pool_size > 1
+        if long_form:
+            windows = split_windows(regions, self.window_seconds, self.overlap_seconds)
+            batches = [
+                (y[int(start * WHISPER_SAMPLE_RATE):int(end * WHISPER_SAMPLE_RATE)], [(0.0, start, end - start)])
+                for start, end, _, _ in windows
+            ]
+        elif voiced >= 0.95 * duration:
+            return self.transcribe(y)
+        else:
+            batches = pack_regions(y, regions, batch_seconds=max(30.0, voiced / self.pool_size))
+
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="whisper") as pool:
+            results = list(pool.map(lambda batch: self.transcribe(batch[0]), batches))
+
+        words = []
+        for i, ((_, spans), result) in enumerate(zip(batches, results)):
+            batch_words = remap_words(result["words"], spans)
+            if long_form:
+                # Each overlap is split at its midpoint: earlier window keeps words before it
+                _, _, keep_from, keep_until = windows[i]
+                batch_words = [w for w in batch_words if keep_from <= w['start'] < keep_until]
+            words.extend(batch_words)
+
+        languages = [r["language"] for r in results if r["language"]]
+        return {
+            "words": words,
+            "language": max(set(languages), key=languages.count) if languages else None,
+        }
+
+
+def split_windows(regions: list, window_seconds: float, overlap_seconds: float) -> list:
+    """
+    Cuts regions into windows of at most window_seconds that overlap by
+    overlap_seconds. Returns [(start, end, keep_from, keep_until)], where the
+    keep range hands each overlap's first half to the earlier window.
+    """
+    step = max(1.0, window_seconds - overlap_seconds)
+    windows = []
+    for region_start, region_end in regions:
+        first = len(windows)
+        start = region_start
+        while True:
+            end = min(start + window_seconds, region_end)
+            windows.append([start, end, float("-inf"), float("inf")])
+            if end >= region_end:
+                break
+            start += step
+        for prev, nxt in zip(windows[first:], windows[first + 1:]):
+            midpoint = (nxt[0] + prev[1]) / 2.0
+            prev[3] = midpoint
+            nxt[2] = midpoint
+    return [tuple(w) for w in windows]
+
+
+def pack_regions(y: np.ndarray, regions: list, batch_seconds: float, gap_seconds: float = 0.5) -> list:
+    """
+    Concatenates voiced regions into batches of up to batch_seconds, separated
+    by short silences. Returns [(audio, spans)], where each span is
+    (batch_offset, song_offset, duration) in seconds.
+    """
+    sr = WHISPER_SAMPLE_RATE
+    gap = np.zeros(int(gap_seconds * sr), dtype=np.float32)
+    batches = []
+    pieces, spans, length = [], [], 0.0
+    for start, end in regions:
+        if pieces and length + (end - start) > batch_seconds:
+            batches.append((np.concatenate(pieces), spans))
+            pieces, spans, length = [], [], 0.0
+        pieces.append(y[int(start * sr):int(end * sr)].astype(np.float32))
+        spans.append((length, start, end - start))
+        pieces.append(gap)
+        length += (end - start) + gap_seconds
+    if pieces:
+        batches.append((np.concatenate(pieces), spans))
+    return batches
+
+
+def remap_words(words: list, spans: list) -> list:
+    """Maps word times inside a packed batch back to song time."""
+    remapped = []
+    for word in words:
+        # The span whose batch offset is the last one at or before the word start
+        span = spans[0]
+        for candidate in spans:
+            if candidate[0] <= word['start']:
+                span = candidate
+            else:
+                break
+        batch_offset, song_offset, duration = span
+        shift = song_offset - batch_offset
+        region_end = song_offset + duration
+        remapped.append({
+            'word': word['word'],
+            'start': min(word['start'] + shift, region_end),
+            'end': min(word['end'] + shift, region_end),
+        })
+    return remapped
+
+
+def words_from_result(result: dict) -> list:
+    """Flattens Whisper segments into a word list for easier frontend sync."""
+    words = []
+    for segment in result['segments']:
+        for word in segment.get('words', []):
+            words.append({
+                'word': word['word'].strip(),
+                'start': word['start'],
+                'end': word['end']
+            })
+    return words
+
+
+def get_transcription_service() -> TranscriptionService:
+    """
+    Returns the shared service for this worker, configured from the environment:
+    WHISPER_MODEL (default "small"), WHISPER_POOL_SIZE (default 1), WHISPER_DEVICE,
+    WHISPER_WINDOW_SECONDS / WHISPER_OVERLAP_SECONDS (long-form windows).
+    Threads come from the process-wide budget (TORCH_THREADS, see configure_torch_threads).
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TranscriptionService(
+                model_size=os.environ.get("WHISPER_MODEL", "small"),
+                pool_size=int(os.environ.get("WHISPER_POOL_SIZE", 1)),
+                device=os.environ.get("WHISPER_DEVICE") or None,
+                window_seconds=float(os.environ.get("WHISPER_WINDOW_SECONDS", 30)),
+                overlap_seconds=float(os.environ.get("WHISPER_OVERLAP_SECONDS", 4)),
+            )
+        return _service
@@ -0,0 +1,43 @@
+import librosa
+import numpy as np
+
+
+def rms_envelope(y: np.ndarray, sr: int, frame_seconds: float = 0.05):
+    """RMS envelope in dB relative to the loudest frame. Returns (db, hop_seconds)."""
+    hop = max(1, int(frame_seconds * sr))
+    rms = librosa.feature.rms(y=y, frame_length=2 * hop, hop_length=hop, center=True)[0]
+    db = librosa.amplitude_to_db(rms, ref=np.max(rms) if rms.size and np.max(rms) > 0 else 1.0)
+    return db, hop / sr
+
+
+def voiced_regions(y: np.ndarray, sr: int, threshold_db: float = -35.0, min_gap: float = 1.0,
+                   min_region: float = 0.3, pad: float = 0.25, frame_seconds: float = 0.05) -> list:
+    """
+    Finds where a separated vocal stem actually has a voice, from its RMS envelope.
+    Frames within threshold_db of the peak count as voiced; regions closer than
+    min_gap are merged, each is padded by pad seconds, and blips shorter than
+    min_region are dropped. Returns [(start_seconds, end_seconds), ...].
+    """
+    if y.size == 0:
+        return []
+    db, hop_seconds = rms_envelope(y, sr, frame_seconds)
+    voiced = db > threshold_db
+
+    # Rising/falling edges of the voiced mask
+    edges = np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1) * hop_seconds
+    ends = np.flatnonzero(edges == -1) * hop_seconds
+
+    duration = len(y) / sr
+    regions = []
+    for start, end in zip(starts, ends):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    return [
+        (float(max(0.0, start - pad)), float(min(duration, end + pad)))
+        for start, end in regions
+        if end - start >= min_region
+    ]
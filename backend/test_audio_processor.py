@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+pytest.importorskip("yt_dlp")
+
+from services.audio_processor import AudioProcessor
+
+
+def test_prefetched_lyrics_are_realigned_on_whisper_when_enabled(tmp_path, monkeypatch):
+    monkeypatch.setenv("LYRICS_ALIGN_WHISPER", "true")
+    processor = AudioProcessor(output_dir=str(tmp_path))
+    vocals = tmp_path / "htdemucs" / "Some Song" / "vocals.wav"
+    vocals.parent.mkdir(parents=True)
+    t = np.arange(4 * 16000) / 16000
+    sf.write(str(vocals), (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32), 16000)
+
+    monkeypatch.setattr(processor.lyrics_scraper, "fetch_lyrics", lambda query: ("one two three", "https://lyrics"))
+    whisper_calls = []
+
+    def transcribe_vocals(path, **kwargs):
+        whisper_calls.append(path)
+        return {"words": [{"word": "one", "start": 0.5, "end": 0.9}, {"word": "three", "start": 2.5, "end": 3.0}],
+                "language": "en"}
+
+    monkeypatch.setattr(processor.transcriber, "transcribe_vocals", transcribe_vocals)
+
+    # The background prefetch never runs Whisper and caches energy-aligned timings
+    processor.prefetch_transcript(str(vocals)).result()
+    assert not whisper_calls
+
+    result = processor.transcribe_audio_detailed(str(vocals))
+    assert result["timing"] == "whisper"
+    assert len(whisper_calls) == 1
+    # The upgraded entry replaces the prefetched one
+    assert processor.transcribe_audio_detailed(str(vocals))["timing"] == "whisper"
+    assert len(whisper_calls) == 1
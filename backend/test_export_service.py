@@ -0,0 +1,31 @@
+import numpy as np
+import soundfile as sf
+
+from services.export_service import ExportService
+
+
+def export_wav(tmp_path, monkeypatch, tone, samplerate):
+    monkeypatch.chdir(tmp_path)
+    sf.write("vocals.wav", tone.T, samplerate, subtype="FLOAT")
+
+    path = ExportService().mix_and_export({"vocals": "vocals.wav"}, {"vocals": 1.0}, 0, format="wav")
+    exported, _ = sf.read(path, dtype="float32", always_2d=True)
+    return exported.T
+
+
+def test_quiet_mix_exports_at_unity_gain(tmp_path, monkeypatch, samplerate, sustained_tone):
+    tone = 0.2 * sustained_tone(3)  # -20 dBFS
+    exported = export_wav(tmp_path, monkeypatch, tone, samplerate)
+
+    assert exported.shape == tone.shape
+    # Only 16-bit quantization separates the export from the mix
+    assert np.abs(exported - tone).max() < 1e-4
+
+
+def test_hot_mix_is_kept_under_full_scale(tmp_path, monkeypatch, samplerate, sustained_tone):
+    tone = 3.2 * sustained_tone(3)
+    exported = export_wav(tmp_path, monkeypatch, tone, samplerate)
+
+    assert exported.shape == tone.shape
+    assert np.abs(exported).max() <= 1.0
+    assert np.abs(exported).max() > 0.95
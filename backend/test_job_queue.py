@@ -0,0 +1,35 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from services.job_queue import JobQueue
+
+
+def write_job(jobs_dir, job_id, state, age_hours):
+    stamp = (datetime.now() - timedelta(hours=age_hours)).isoformat()
+    job = {"id": job_id, "state": state, "payload": None, "result": None, "error": None,
+           "created_at": stamp, "updated_at": stamp}
+    with open(os.path.join(jobs_dir, f"{job_id}.json"), "w") as f:
+        json.dump(job, f)
+
+
+def test_jobs_live_under_the_root(tmp_path):
+    queue = JobQueue(root=str(tmp_path), max_workers=1)
+    job = queue.submit(lambda set_state: {"ok": True})
+    queue.executor.shutdown(wait=True)
+
+    assert os.path.exists(tmp_path / "jobs" / f"{job['id']}.json")
+    assert queue.get(job["id"])["state"] == "done"
+
+
+def test_finished_jobs_are_pruned_by_age_and_count(tmp_path):
+    jobs_dir = tmp_path / "jobs"
+    jobs_dir.mkdir()
+    write_job(jobs_dir, "expired", "done", age_hours=100)
+    for i, age in enumerate([3, 2, 1]):
+        write_job(jobs_dir, f"recent{i}", "failed", age_hours=age)
+
+    queue = JobQueue(root=str(tmp_path), max_workers=1, max_age=72 * 3600, max_kept=2)
+
+    assert sorted(queue.jobs) == ["recent1", "recent2"]
+    assert sorted(os.listdir(jobs_dir)) == ["recent1.json", "recent2.json"]
@@ -0,0 +1,32 @@
+import numpy as np
+import soundfile as sf
+
+from services.lyrics_aligner import ALIGN_SAMPLE_RATE, LyricsAligner
+
+SR = ALIGN_SAMPLE_RATE
+LYRICS = "one two three four five six seven eight nine ten eleven twelve"
+
+
+def sung_phrases(regions, seconds):
+    """Pulsed tones in each (start, end) region, silence elsewhere."""
+    t = np.arange(int(seconds * SR)) / SR
+    y = np.zeros_like(t)
+    for start, end in regions:
+        inside = (t >= start) & (t < end)
+        y[inside] = 0.3 * np.sin(2 * np.pi * 220 * t[inside]) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t[inside]))
+    return y.astype(np.float32)
+
+
+def test_interpolated_words_stay_out_of_silent_gaps(tmp_path):
+    path = str(tmp_path / "vocals.wav")
+    sf.write(path, sung_phrases([(1.0, 5.0), (11.0, 15.0)], 16.0), SR)
+    # Only the first and last words were heard; everything between is interpolated
+    heard = [{"word": "one", "start": 1.1, "end": 1.4}, {"word": "twelve", "start": 14.2, "end": 14.6}]
+
+    words = LyricsAligner().align(LYRICS, path, heard)
+
+    starts = [w["start"] for w in words]
+    assert starts == sorted(starts) and len(set(starts)) == len(starts)
+    assert starts[0] == 1.1 and starts[-1] == 14.2
+    # voiced_regions pads each phrase by 0.25 s
+    assert all(start < 5.25 or start >= 10.75 for start in starts)
@@ -0,0 +1,106 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services.lyrics_scraper import LyricsScraper
+
+LYRICS = "Maru vaarthai paesaathe madi meethu nee thoongidu " * 4
+
+PAGES = {
+    "/lyrics": f"<html><body><p>menu</p><p>{LYRICS}</p></body></html>",
+    "/empty": "<html><body><p>No lyrics here</p></body></html>",
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves canned pages in place of the lyrics sites. /slow/... waits before answering."""
+
+    def do_GET(self):
+        path = self.path
+        if path.startswith("/slow"):
+            time.sleep(1.5)
+            path = path[len("/slow"):]
+        body = PAGES.get(path)
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Type", "text/html")
+        self.end_headers()
+        self.wfile.write((body or "").encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def make_scraper(tmp_path, urls, **kwargs):
+    calls = []
+
+    def search(query, num_results):
+        calls.append(query)
+        return urls
+
+    scraper = LyricsScraper(search=search, cache_dir=str(tmp_path), **kwargs)
+    return scraper, calls
+
+
+def test_first_good_hit_wins(tmp_path, stub_url):
+    scraper, _ = make_scraper(tmp_path, [f"{stub_url}/slow/lyrics", f"{stub_url}/empty", f"{stub_url}/lyrics"])
+    started = time.monotonic()
+    lyrics, url = scraper.fetch_lyrics("some song")
+    assert lyrics.strip() == LYRICS.strip()
+    assert url == f"{stub_url}/lyrics"
+    # Pages are fetched concurrently, so the slow one doesn't hold up the answer
+    assert time.monotonic() - started < 1.0
+
+
+def test_hits_and_misses_are_cached(tmp_path, stub_url):
+    scraper, calls = make_scraper(tmp_path, [f"{stub_url}/lyrics"])
+    assert scraper.fetch_lyrics("cached song")[1] == f"{stub_url}/lyrics"
+    assert scraper.fetch_lyrics("Cached Song")[1] == f"{stub_url}/lyrics"
+    assert len(calls) == 1
+
+    scraper, calls = make_scraper(tmp_path, [f"{stub_url}/empty", f"{stub_url}/missing"])
+    assert scraper.fetch_lyrics("unknown song") == (None, None)
+    assert scraper.fetch_lyrics("unknown song") == (None, None)
+    assert len(calls) == 1
+
+
+def test_expired_entries_are_refetched(tmp_path, stub_url):
+    scraper, calls = make_scraper(tmp_path, [f"{stub_url}/empty"], negative_ttl=0)
+    scraper.fetch_lyrics("flaky song")
+    time.sleep(0.01)
+    scraper.fetch_lyrics("flaky song")
+    assert len(calls) == 2
+
+
+def test_deadline_cuts_lookup_short(tmp_path, stub_url):
+    scraper, calls = make_scraper(tmp_path, [f"{stub_url}/slow/lyrics"], deadline=0.3)
+    started = time.monotonic()
+    assert scraper.fetch_lyrics("slow song") == (None, None)
+    assert time.monotonic() - started < 1.0
+    # A timeout isn't cached as a miss
+    scraper.deadline = 5.0
+    assert scraper.fetch_lyrics("slow song")[1] == f"{stub_url}/slow/lyrics"
+    assert len(calls) == 2
+
+
+def test_timed_out_lookup_does_not_starve_the_next(tmp_path, stub_url):
+    results = {
+        "stuck song lyrics": [f"{stub_url}/slow/lyrics"] * 3,
+        "stuck song again lyrics": [f"{stub_url}/slow/empty"] * 3,
+        "next song lyrics": [f"{stub_url}/lyrics"],
+    }
+    scraper = LyricsScraper(search=lambda query, n: results[query], cache_dir=str(tmp_path), deadline=0.5)
+    assert scraper.fetch_lyrics("stuck song") == (None, None)
+    assert scraper.fetch_lyrics("stuck song again") == (None, None)
+    # The stuck fetches are still running, but this lookup has its own threads
+    assert scraper.fetch_lyrics("next song")[1] == f"{stub_url}/lyrics"
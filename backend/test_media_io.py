@@ -0,0 +1,51 @@
+import io
+import os
+
+import pytest
+
+from services.media_io import (
+    MediaTooLarge, UnsupportedMedia, is_generated_name, save_upload, sniff_audio_extension
+)
+
+
+@pytest.mark.parametrize("head, extension", [
+    (b"RIFF\x24\x00\x00\x00WAVEfmt ", ".wav"),
+    (b"fLaC\x00\x00\x00\x22", ".flac"),
+    (b"OggS\x00\x02\x00\x00", ".ogg"),
+    (b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81", ".webm"),
+    (b"\x00\x00\x00\x20ftypM4A ", ".m4a"),
+    (b"FORM\x00\x00\x00\x00AIFF", ".aiff"),
+    (b"ID3\x04\x00\x00\x00\x00", ".mp3"),
+    (b"\xff\xfb\x90\x64\x00\x00", ".mp3"),
+])
+def test_extension_comes_from_magic_bytes(head, extension):
+    # The magic bytes win over a misleading content type
+    assert sniff_audio_extension(head, "application/octet-stream") == extension
+
+
+def test_unknown_bytes_fall_back_to_declared_type():
+    assert sniff_audio_extension(b"\x00" * 16, "audio/mpeg; charset=binary") == ".mp3"
+    with pytest.raises(UnsupportedMedia):
+        sniff_audio_extension(b"<!DOCTYPE html>", "text/html")
+
+
+def test_upload_is_saved_under_a_generated_name(tmp_path):
+    path = save_upload(io.BytesIO(b"fLaC" + b"\0" * 100), str(tmp_path))
+
+    assert path.endswith(".flac")
+    assert is_generated_name(os.path.splitext(os.path.basename(path))[0])
+    assert not is_generated_name("Some Song - Artist")
+
+
+def test_oversized_upload_is_refused_and_removed(tmp_path):
+    with pytest.raises(MediaTooLarge):
+        save_upload(io.BytesIO(b"fLaC" + b"\0" * 5000), str(tmp_path), max_bytes=1000)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_empty_upload_is_refused(tmp_path):
+    with pytest.raises(UnsupportedMedia):
+        save_upload(io.BytesIO(b""), str(tmp_path))
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+from services.effect_chains import ChainRegistry
+from services.pitch_correction import PitchCorrector, correction_segments
+
+
+def test_take_too_short_to_track_keeps_fixed_transpose(tmp_path, samplerate, sustained_tone):
+    assert correction_segments(np.array([]), 0.01, samplerate, 500, default_shift=2.0) == [(0, 500, 2.0)]
+
+    tone = sustained_tone(0.01)
+    path = str(tmp_path / "take.wav")
+    sf.write(path, tone.T, samplerate, subtype="FLOAT")
+    PitchCorrector(ChainRegistry(), root=str(tmp_path)).correct(path, str(tmp_path / "out.wav"), "C major", semitones=2)
+
+    assert sf.info(str(tmp_path / "out.wav")).frames == tone.shape[1]
+
+
+def test_concurrent_analysis_of_one_take_tracks_once(tmp_path, samplerate, sustained_tone):
+    path = str(tmp_path / "take.wav")
+    sf.write(path, sustained_tone(3).T, samplerate, subtype="FLOAT")
+    corrector = PitchCorrector(ChainRegistry(), root=str(tmp_path))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: corrector.analyze(path), range(8)))
+
+    assert all(result is results[0] for result in results)
+    assert len(corrector._analysis_locks) == 0
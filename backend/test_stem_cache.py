@@ -0,0 +1,54 @@
+import itertools
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from services import stem_cache
+from services.stem_cache import StemCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Strictly increasing time.time() for the cache, so LRU order is deterministic."""
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(stem_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def rendered(tmp_path, name, size):
+    path = tmp_path / name / "vocals.wav"
+    path.parent.mkdir()
+    path.write_bytes(b"\0" * size)
+    return {"vocals": str(path)}
+
+
+def test_least_recently_used_entry_is_evicted_over_budget(tmp_path, clock):
+    cache = StemCache(root=str(tmp_path), max_bytes=250)
+    a, b, c = (rendered(tmp_path, name, 100) for name in "abc")
+    cache.store("a", a)
+    cache.store("b", b)
+    assert cache.lookup("a") == a  # a is now more recent than b
+
+    cache.store("c", c)
+
+    assert cache.lookup("b") is None
+    assert not os.path.exists(b["vocals"]) and not os.path.exists(os.path.dirname(b["vocals"]))
+    assert cache.lookup("a") == a and cache.lookup("c") == c
+    assert cache.stats()["evictions"] == 1
+    assert cache.total_bytes() == 200
+
+
+def test_newest_entry_is_kept_even_when_alone_over_budget(tmp_path, clock):
+    cache = StemCache(root=str(tmp_path), max_bytes=50)
+    big = rendered(tmp_path, "big", 100)
+
+    cache.store("big", big)
+
+    assert cache.lookup("big") == big
+
+
+def test_index_survives_a_restart(tmp_path, clock):
+    files = rendered(tmp_path, "a", 10)
+    StemCache(root=str(tmp_path), max_bytes=100).store("a", files)
+
+    assert StemCache(root=str(tmp_path), max_bytes=100).lookup("a") == files
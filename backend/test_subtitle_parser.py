@@ -0,0 +1,35 @@
+from services.subtitle_parser import parse_vtt_lines, to_word_dicts
+
+
+def parse(text):
+    return to_word_dicts(parse_vtt_lines(text.splitlines()))
+
+
+def test_two_line_cue_is_spread_once():
+    words = parse("""WEBVTT
+
+00:00:03.000 --> 00:00:04.000
+line one
+line two
+""")
+    assert [w["word"] for w in words] == ["line", "one", "line", "two"]
+    assert [w["start"] for w in words] == [3.0, 3.25, 3.5, 3.75]
+    assert words[-1]["end"] == 4.0
+
+
+def test_rolling_captions_keep_each_word_once():
+    words = parse("""WEBVTT
+
+00:00:01.000 --> 00:00:02.000 align:start position:0%
+hello<00:00:01.500><c> world</c>
+
+00:00:02.000 --> 00:00:02.010 align:start position:0%
+hello world
+
+
+00:00:02.010 --> 00:00:03.000 align:start position:0%
+hello world
+again<00:00:02.500><c> and</c>
+""")
+    assert [w["word"] for w in words] == ["hello", "world", "again", "and"]
+    assert [w["start"] for w in words] == [1.0, 1.5, 2.01, 2.5]
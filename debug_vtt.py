@@ -1,5 +1,9 @@
-import webvtt
 import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from services.subtitle_parser import parse_vtt, to_word_dicts
 
 vtt_path = "temp_audio/Maruvaarthai - Lyric Video ｜ Enai Noki Paayum Thota ｜ Dhanush ｜ Darbuka Siva ｜ Gautham Menon.en.vtt"
 
@@ -9,40 +13,13 @@ if not os.path.exists(vtt_path):
     exit(1)
 
 try:
-    print("Parsing with webvtt...")
-    captions = webvtt.read(vtt_path)
-    print(f"Found {len(captions)} captions.")
-    
-    lyrics = []
-    for caption in captions:
-        # Clean up text
-        text = caption.text.strip().replace('\n', ' ')
-        if not text:
-            continue
-            
-        # Parse timestamps (HH:MM:SS.mmm -> seconds)
-        def parse_time(t_str):
-            h, m, s = t_str.split(':')
-            return int(h) * 3600 + int(m) * 60 + float(s)
-            
-        start = parse_time(caption.start)
-        end = parse_time(caption.end)
-        
-        # Split into words for word-level sync simulation
-        words = text.split(' ')
-        duration = end - start
-        word_duration = duration / len(words)
-        
-        current_time = start
-        for word in words:
-            lyrics.append({
-                'word': word,
-                'start': current_time,
-                'end': current_time + word_duration
-            })
-            current_time += word_duration
-            
-    print(f"Extracted {len(lyrics)} words.")
+    print("Parsing...")
+    started = time.perf_counter()
+    columns = parse_vtt(vtt_path)
+    elapsed = time.perf_counter() - started
+
+    lyrics = to_word_dicts(columns)
+    print(f"Extracted {len(lyrics)} words in {elapsed * 1000:.1f} ms.")
     print("First 5 words:", lyrics[:5])
 
 except Exception as e:
@@ -236,13 +236,18 @@ export default function StudioLayout() {
             const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/transcribe`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ audio_url: vocalsUrl }),
+                body: JSON.stringify({ audio_url: vocalsUrl, format: 'columns' }),
             });
 
             if (!res.ok) throw new Error('Failed to fetch lyrics');
 
             const data = await res.json();
             console.log('Lyrics received:', data);
+            // Columnar payload: { words: [], starts: [], ends: [] }
+            if (data.lyrics && Array.isArray(data.lyrics.words)) {
+                const { words, starts, ends } = data.lyrics;
+                data.lyrics = words.map((word: string, i: number) => ({ word, start: starts[i], end: ends[i] }));
+            }
             if (data.lyrics && Array.isArray(data.lyrics)) {
                 console.log('Setting lyrics state with', data.lyrics.length, 'items');
                 setLyrics(data.lyrics);
@@ -256,6 +261,30 @@ export default function StudioLayout() {
         }
     };
 
+    // /process queues a job; poll it until the stems are ready
+    const waitForJob = async (jobId: string) => {
+        const statusText: { [state: string]: string } = {
+            queued: 'Waiting in queue...',
+            downloading: 'Downloading audio...',
+            key: 'Detecting key...',
+            separating: 'Separating stems (this may take a moment)...',
+        };
+        const progress: { [state: string]: number } = { queued: 15, downloading: 25, key: 40, separating: 60 };
+
+        while (true) {
+            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000'}/jobs/${jobId}`);
+            if (!res.ok) throw new Error('Failed to fetch job status');
+
+            const job = await res.json();
+            if (job.state === 'done') return job.result;
+            if (job.state === 'failed') throw new Error(job.error || 'Processing failed');
+
+            setImportStatus(statusText[job.state] || 'Processing audio...');
+            setImportProgress(progress[job.state] || 50);
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    };
+
     const handleFileUpload = async (e: React.ChangeEvent<HTMLInputElement>) => {
         const file = e.target.files?.[0];
         if (!file) return;
@@ -289,10 +318,7 @@ export default function StudioLayout() {
 
             if (!res.ok) throw new Error('Processing failed');
 
-            setImportProgress(50);
-            setImportStatus('Separating stems (this may take a moment)...');
-
-            const data = await res.json();
+            const data = await waitForJob((await res.json()).job_id);
             if (data.status === 'error') throw new Error(data.message);
 
             setStems(data.stems);
@@ -336,10 +362,7 @@ export default function StudioLayout() {
 
             if (!res.ok) throw new Error('Failed to process audio');
 
-            setImportProgress(50);
-            setImportStatus('Separating stems (this may take a moment)...');
-
-            const data = await res.json();
+            const data = await waitForJob((await res.json()).job_id);
             setStems(data.stems);
             setKey(data.key);
 